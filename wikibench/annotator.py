@@ -1,8 +1,15 @@
 import json
 from wikibench.evaluation import *
+from wikibench.transport import Transport
+from wikibench.instrumentation import record_request
 
 
 class Annotator(object):
+    # Keep-alive connections shared by all the annotators
+    transport = Transport()
+    # Optional ResponseCache shared by all the annotators
+    cache = None
+
     def __str__(self):
         return self.__class__.__name__
 
@@ -25,6 +32,34 @@ class Annotator(object):
     def set_configuration(self, configuration):
         pass
 
+    def request(self, method, url, **kwargs):
+        response = self.cached_request(method, url, **kwargs)
+        record_request(len(response.content), kwargs.get('params'),
+                       kwargs.get('data'))
+        return response
+
+    def cached_request(self, method, url, **kwargs):
+        if self.cache is None:
+            return self.transport.request(method, url, **kwargs)
+
+        key = self.cache.key(self.__class__.__name__, method, url,
+                             kwargs.get('params'), kwargs.get('data'))
+        response = self.cache.get(key)
+
+        if response is None:
+            response = self.transport.request(method, url, **kwargs)
+
+            if response.status_code == 200:
+                self.cache.put(key, response)
+
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
     def pretty_print(self, instance, mentions):
         output = ""
         prev = 0
@@ -1,4 +1,3 @@
-import requests
 import logging
 from wikibench.dataset import Mention
 from wikibench.annotator import Annotator
@@ -39,7 +38,7 @@ class AIDAAnnotator(Annotator):
         url = params.pop('url')
         params['text'] = output
 
-        r = requests.post(url, data=params)
+        r = self.post(url, data=params)
         data = r.json()
 
         mentions = []
@@ -61,9 +60,9 @@ class AIDAAnnotator(Annotator):
         data = self.get_params()
         url = data.pop('url')
         data['text'] = instance.text
-        data = requests.post(url,
-                             params=self.get_params(),
-                             data=data).json()
+        data = self.post(url,
+                         params=self.get_params(),
+                         data=data).json()
 
         mentions = []
 
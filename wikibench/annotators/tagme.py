@@ -1,17 +1,26 @@
-import requests
 import logging
 from wikibench.dataset import Mention
 from wikibench.annotator import Annotator
+from wikibench.instrumentation import record_server_time
 
 
 class TagMEAnnotator(Annotator):
     def __init__(self, *args, **kwargs):
-        self.url = kwargs.pop('url', 'http://tagme.di.unipi.it')
-        self.annotate_url = self.url + '/tag'
+        self.set_url(kwargs.pop('url', 'http://tagme.di.unipi.it'))
         self.params = kwargs
         self.log = logging.getLogger(self.__class__.__name__)
 
+    def set_url(self, url):
+        self.url = url
+        self.annotate_url = self.url + '/tag'
+
     def set_configuration(self, configuration):
+        configuration = dict(configuration)
+
+        # The base URL of the service is not a parameter of the requests
+        if 'url' in configuration:
+            self.set_url(configuration.pop('url'))
+
         self.params.update(configuration)
 
     def __str__(self):
@@ -29,11 +38,11 @@ class TagMEAnnotator(Annotator):
     def annotate(self, instance):
         data = self.get_params()
         data['text'] = instance.text
-        data = requests.post(self.annotate_url,
-                             params=self.get_params(),
-                             data=data).json()
+        data = self.post(self.annotate_url,
+                         params=self.get_params(),
+                         data=data).json()
 
-        print data['time']
+        record_server_time(data.get('time'))
 
         mentions = []
 
@@ -1,14 +1,26 @@
 import json
-import requests
 import logging
-from wikibench.dataset import Mention
+from multiprocessing.pool import ThreadPool
+from wikibench.dataset import Mention, MappedInstances
 from wikibench.annotator import Annotator
+from wikibench.instrumentation import record_server_time
 
 FORMAT = '%(levelname)s - %(name)s - %(message)s'
 logging.basicConfig(format=FORMAT)
 
 
 class WATMention(Mention):
+    __slots__ = (
+        'length', 'numTokens', 'linkProb', 'anchorFrequency', 'numLinks',
+        'boostedLinks', 'ambiguity', 'idf', 'collectionProb', 'documentProb',
+        'gamma1', 'gamma2', 'clarity', 'mutualDependency',
+        'pageRank', 'pageHits', 'hub', 'authority', 'clustering',
+        'eigenVector', 'inDegree', 'outDegree', 'synonymy', 'commonness',
+        'rho', 'localCoherence', 'globalCoherence', 'contributions',
+        'contributionRatio', 'pointsTo', 'pointedBy',
+        'modelScore', 'ranking', 'spotFeatures', 'annotationFeatures',
+    )
+
     def __init__(self, **kwargs):
         # In case of spot title and id are not defined
         super(WATMention, self).__init__(
@@ -17,7 +29,7 @@ class WATMention(Mention):
             kwargs.pop('end'),
             kwargs.pop('title', None),
             kwargs.pop('id', 0),
-            kwargs.pop('entities', [])
+            kwargs.pop('entities', ())
         )
 
         self.length = self.end - self.start
@@ -185,18 +197,27 @@ class WATAnnotator(Annotator):
     )
 
     def __init__(self, *args, **kwargs):
-        self.url = kwargs.pop('url', 'http://wikisense.mkapp.it')
-        # self.url = kwargs.pop('url', 'http://localhost:9000')
+        self.set_url(kwargs.pop('url', 'http://wikisense.mkapp.it'))
+        self.params = kwargs
+        self.resolved = {}
+        self.log = logging.getLogger(self.__class__.__name__)
+
+    def set_url(self, url):
+        self.url = url
         self.spot_url = self.url + '/tag/spot'
         self.disambiguate_url = self.url + '/tag/disambiguate'
         self.annotate_url = self.url + '/tag/tag'
         self.is_disambiguation_url = self.url + '/wiki/disambiguation'
         self.redirect_url = self.url + '/wiki/redirect'
         self.title_url = self.url + '/wiki/title'
-        self.params = kwargs
-        self.log = logging.getLogger(self.__class__.__name__)
 
     def set_configuration(self, configuration):
+        configuration = dict(configuration)
+
+        # The base URL of the service is not a parameter of the requests
+        if 'url' in configuration:
+            self.set_url(configuration.pop('url'))
+
         self.params.update(configuration)
 
     def __str__(self):
@@ -226,10 +247,12 @@ class WATAnnotator(Annotator):
 
         headers = {'Content-type': 'application/json'}
 
-        data = requests.post(self.spot_url,
-                             params=params,
-                             data=data,
-                             headers=headers).json()
+        data = self.post(self.spot_url,
+                         params=params,
+                         data=data,
+                         headers=headers).json()
+
+        record_server_time(data.get('time'))
 
         mentions = [WATMention(**spot) for spot in data['spots']]
 
@@ -241,12 +264,12 @@ class WATAnnotator(Annotator):
     def annotate(self, instance):
         data = json.dumps({'text': instance.text})
         headers = {'Content-type': 'application/json'}
-        data = requests.post(self.annotate_url,
-                             params=self.get_params(),
-                             data=data,
-                             headers=headers).json()
+        data = self.post(self.annotate_url,
+                         params=self.get_params(),
+                         data=data,
+                         headers=headers).json()
 
-        print data['time']
+        record_server_time(data.get('time'))
 
         mentions = [WATMention(**spot) for spot in data['annotations']]
 
@@ -267,10 +290,10 @@ class WATAnnotator(Annotator):
 
         headers = {'Content-type': 'application/json'}
 
-        r = requests.post(self.disambiguate_url,
-                          params=self.get_params(),
-                          data=data,
-                          headers=headers)
+        r = self.post(self.disambiguate_url,
+                      params=self.get_params(),
+                      data=data,
+                      headers=headers)
 
         print r.url
 
@@ -282,6 +305,8 @@ class WATAnnotator(Annotator):
             self.log.error("Returning empty set")
             return []
 
+        record_server_time(data.get('time'))
+
         mentions = [WATMention(**spot) for spot in data['annotations']]
 
         for m in mentions:
@@ -291,33 +316,83 @@ class WATAnnotator(Annotator):
         return mentions
 
     def resolve_redirect(self, wid):
-        return requests.get(self.redirect_url + '/%d' % wid).json()
+        return self.get(self.redirect_url + '/%d' % wid).json()
 
     def get_title(self, wid):
-        return requests.get(self.title_url + '/%d' % wid)\
-                       .json().replace("_", " ")
+        return self.get(self.title_url + '/%d' % wid)\
+                   .json().replace("_", " ")
 
     def is_disambiguation(self, wid):
-        return requests.get(self.is_disambiguation_url + '/%d' % wid).json()
+        return self.get(self.is_disambiguation_url + '/%d' % wid).json()
 
-    def reshape(self, dataset):
+    def resolve(self, wid):
+        """
+        @return a (is_disambiguation, wid, title) tuple where wid and title
+                are the ones of the redirect target or None if the entity
+                is a disambiguation page or is not a redirect
+        """
+        if wid not in self.resolved:
+            if self.is_disambiguation(wid):
+                self.resolved[wid] = (True, None, None)
+            else:
+                new_wid = self.resolve_redirect(wid)
+
+                if new_wid != wid:
+                    self.resolved[wid] = (False, new_wid,
+                                          self.get_title(new_wid))
+                else:
+                    self.resolved[wid] = (False, None, None)
+
+        return self.resolved[wid]
+
+    def reshape_instance(self, instance):
+        instance.mentions = filter(
+            lambda x: not self.resolve(x.wid)[0],
+            instance.mentions
+        )
+
+        for mention in instance:
+            _, new_wid, title = self.resolve(mention.wid)
+
+            if new_wid is not None:
+                mention.wid = new_wid
+                mention.title = title
+
+        return instance
+
+    def reshape(self, dataset, workers=8):
         """
         Reshape the dataset possibly resolving redirect issues. We transform
         the dataset in place.
+
+        The distinct WIDs of the dataset are resolved once, using up to
+        workers concurrent requests, before rewriting the mentions. Lazily
+        loaded instances are rewritten each time they are read.
         """
+        wids = set()
 
         for instance in dataset:
-            instance.mentions = filter(
-                lambda x: not self.is_disambiguation(x.wid),
-                instance.mentions
-            )
+            wids.update(map(lambda x: x.wid, instance.mentions))
 
-            for mention in instance:
-                new_wid = self.resolve_redirect(mention.wid)
+        wids = sorted(wids)
+        pool = ThreadPool(max(1, workers))
 
-                if new_wid != mention.wid:
-                    mention.wid = new_wid
-                    mention.title = self.get_title(mention.wid)
+        try:
+            iterable = pool.imap_unordered(self.resolve, wids)
+
+            for count, _ in enumerate(iterable, 1):
+                if count % 1000 == 0 or count == len(wids):
+                    print "Resolved %d/%d WIDs" % (count, len(wids))
+        finally:
+            pool.terminate()
+            pool.join()
+
+        if isinstance(dataset.instances, list):
+            for instance in dataset:
+                self.reshape_instance(instance)
+        else:
+            dataset.instances = MappedInstances(dataset.instances,
+                                                self.reshape_instance)
 
         return dataset
 
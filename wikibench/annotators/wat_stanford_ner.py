@@ -1,5 +1,4 @@
 import json
-import requests
 import logging
 from wikibench.dataset import Mention
 from wikibench.annotator import Annotator
@@ -33,10 +32,10 @@ class WATStanfordNERD(Annotator):
 
         headers = {'Content-type': 'application/json'}
 
-        data = requests.post(self.spot_url,
-                             params=params,
-                             data=data,
-                             headers=headers).json()
+        data = self.post(self.spot_url,
+                         params=params,
+                         data=data,
+                         headers=headers).json()
 
         mentions = []
         for spot in data:
@@ -1,6 +1,8 @@
 import logging
+import cPickle as pickle
 from optparse import OptionParser
 from wikibench.metrics import Metrics
+from wikibench.dataset import Dataset
 
 FORMAT = '%(levelname)s - %(name)s - %(message)s'
 logging.basicConfig(format=FORMAT)
@@ -16,6 +18,14 @@ class Benchmark(object):
         self.parser = OptionParser("%s" % self.name)
         self.parser.add_option("-s", "--slice", dest="slice", default="",
                                help="Slice the input dataset")
+        self.parser.add_option("--shard", dest="shard", default=None,
+                               metavar="i/N",
+                               help="Only run on the i-th of N disjoint "
+                                    "shards of the (sliced) dataset")
+        self.parser.add_option("--metrics", dest="metrics", default=None,
+                               metavar="FILE",
+                               help="Save the collected metrics in FILE, "
+                                    "to be merged with the other shards")
         self.parser.add_option("-v", "--verbose", dest="verbose",
                                action="store_true", default=False,
                                help="Produce more messages")
@@ -24,6 +34,8 @@ class Benchmark(object):
         #                        help="Shuffle dataset")
 
         self.opt_slice = []
+        self.opt_shard = None
+        self.opt_metrics = None
         self.opt_verbose = []
         # self.opt_shuffle = False
 
@@ -37,6 +49,13 @@ class Benchmark(object):
     def parse_options(self, option):
         self.opt_verbose = option.verbose
         self.opt_slice = map(int, filter(lambda x: x, option.slice.split(':')))
+        self.opt_metrics = option.metrics
+
+        if option.shard is not None:
+            try:
+                self.opt_shard = Dataset.parse_shard(option.shard)
+            except ValueError, exc:
+                self.parser.error(str(exc))
         # self.opt_shuffle = option.shuffle
 
         if self.opt_verbose:
@@ -59,13 +78,17 @@ class Benchmark(object):
         # Apply optional slicing if requested
         if self.opt_slice:
             start = self.opt_slice[0]
-            end = len(dataset)
+            end = None
 
             if len(self.opt_slice) > 1:
-                end = min(end, self.opt_slice[1])
+                end = self.opt_slice[1]
 
             dataset = dataset[start:end]
 
+        if self.opt_shard is not None:
+            dataset = dataset.shard(*self.opt_shard)
+
+        # Instances are processed as they are read from the dataset
         for instance in dataset:
             try:
                 result = self.run_instance(annotator, instance)
@@ -80,12 +103,28 @@ class Benchmark(object):
 
         self.interpret_results(annotator, results)
 
+        if self.opt_metrics:
+            self.save_metrics(self.opt_metrics)
+
     def run_instance(self, annotator, instance):
         raise NotImplemented
 
     def interpret_results(self, annotator, results):
         pass
 
+    def save_metrics(self, filename):
+        with open(filename, 'wb') as outputfile:
+            pickle.dump(self.metrics, outputfile, pickle.HIGHEST_PROTOCOL)
+
+    def merge_metrics(self, filenames):
+        """
+        Merge the metrics saved by other runs, e.g. one per shard, into
+        the ones of this benchmark
+        """
+        for filename in filenames:
+            with open(filename, 'rb') as inputfile:
+                self.metrics.merge(pickle.load(inputfile))
+
     def summary(self):
         count_msg = "[TOT: %d TP: %d TN: %d FP: %d FN: %d]" % (
             self.metrics.tp + self.metrics.fn,
@@ -109,9 +148,15 @@ class Benchmark(object):
 
 if __name__ == "__main__":
     import sys
-    from wikibench.dataset import Dataset
     from wikibench.utils import create_annotator, create_benchmark
 
+    if sys.argv[1:2] == ['--merge']:
+        # Summarize the metrics saved by the shards of a run
+        benchmark = Benchmark()
+        benchmark.merge_metrics(sys.argv[2:])
+        benchmark.summary()
+        sys.exit(0)
+
     benchmark_name, annotator_name, dataset = sys.argv[1:4]
 
     dataset = Dataset.load(dataset)
@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+class CacheMissError(Exception):
+    pass
+
+
+class CachedResponse(object):
+    """
+    Minimal stand-in for requests.Response built from a cache entry
+    """
+    def __init__(self, url, status_code, content):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf8')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class ResponseCache(object):
+    """
+    Content addressed cache of annotator responses stored in a sqlite
+    database. Entries are keyed on the annotator class, the method and
+    endpoint, the sorted parameters and a hash of the request body (text
+    and spans). When the total size of the stored responses exceeds
+    max_size bytes the least recently used entries are evicted.
+
+    In replay mode the database, which must exist, is opened read-only
+    and a miss raises CacheMissError, so a benchmark can be rerun offline.
+    """
+    def __init__(self, filename, max_size=None, replay=False):
+        self.filename = filename
+        self.max_size = max_size
+        self.replay = replay
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        if replay and not os.path.isfile(filename):
+            raise IOError("No cache to replay in %s" % filename)
+
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.text_factory = str
+
+        if replay:
+            # URI filenames (mode=ro) are not available to Python 2, the
+            # pragma makes sqlite refuse any write on this connection
+            self.db.execute("PRAGMA query_only = ON")
+        else:
+            self.create()
+
+        self.size = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+
+    def create(self):
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, url TEXT, status INTEGER, "
+            "content BLOB, size INTEGER, atime REAL)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_atime ON responses (atime)"
+        )
+        self.db.commit()
+
+    @staticmethod
+    def key(annotator, method, url, params=None, data=None):
+        def canonical(value):
+            if isinstance(value, dict):
+                return json.dumps(value, sort_keys=True)
+            if isinstance(value, unicode):
+                return value.encode('utf8')
+            return str(value or '')
+
+        body = hashlib.sha1(canonical(data)).hexdigest()
+        return hashlib.sha1('\t'.join([
+            annotator, method, url, canonical(params), body
+        ])).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT url, status, content FROM responses WHERE key = ?",
+                (key,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+
+                if self.replay:
+                    raise CacheMissError("No cached response for %s" % key)
+
+                return None
+
+            self.hits += 1
+
+            if not self.replay:
+                self.db.execute(
+                    "UPDATE responses SET atime = ? WHERE key = ?",
+                    (time.time(), key)
+                )
+                self.db.commit()
+
+        url, status, content = row
+        return CachedResponse(url, status, str(content))
+
+    def put(self, key, response):
+        if self.replay:
+            return
+
+        content = response.content
+
+        with self.lock:
+            old = self.db.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+            if old is not None:
+                self.size -= old[0]
+
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, response.url, response.status_code,
+                 sqlite3.Binary(content), len(content), time.time())
+            )
+            self.size += len(content)
+            self.evict()
+            self.db.commit()
+
+    def evict(self):
+        if self.max_size is None:
+            return
+
+        while self.size > self.max_size:
+            row = self.db.execute(
+                "SELECT key, size FROM responses ORDER BY atime LIMIT 1"
+            ).fetchone()
+
+            if row is None:
+                break
+
+            self.db.execute("DELETE FROM responses WHERE key = ?", (row[0],))
+            self.size -= row[1]
+
+    def summary(self):
+        return "[HITS: %d MISSES: %d SIZE: %d]" % (
+            self.hits, self.misses, self.size
+        )
@@ -0,0 +1,500 @@
+"""
+Single file columnar dataset format.
+
+The file starts with a fixed header followed by these sections:
+
+  - instance ids (N int64)
+  - byte offsets of each instance text in the text blob (N + 1 int64)
+  - offsets of each instance mentions in the mention columns (N + 1 int64)
+  - one array per mention column: start, end, wid (M int64), title and
+    spot indices in the string table (M int32), score1 and score2
+    (M float64)
+  - byte offsets of the interned strings (S + 1 int64)
+  - the UTF-8 string blob (the first string is the dataset name)
+  - the UTF-8 text blob
+
+All values are little endian. The file is memory-mapped and instances are
+only materialized when accessed.
+
+The module also provides ResultStore, the columnar counterpart of the
+per instance annotation TSVs written by the experiments.
+"""
+import os
+import sys
+import mmap
+import struct
+import threading
+from array import array
+from wikibench.dataset import Dataset, Instance, Mention
+
+MAGIC = 'WKBD'
+VERSION = 1
+HEADER = struct.Struct('<4sIqqq')
+COLUMNS = (
+    ('start', 'q'),
+    ('end', 'q'),
+    ('wid', 'q'),
+    ('title', 'i'),
+    ('spot', 'i'),
+    ('score1', 'd'),
+    ('score2', 'd'),
+)
+
+
+def encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf8')
+    return str(value)
+
+
+def pack(fmt, values):
+    return struct.pack('<%d%s' % (len(values), fmt), *values)
+
+
+class StringTable(object):
+    def __init__(self):
+        self.index = {}
+        self.strings = []
+
+    def intern(self, value):
+        if value is None:
+            return -1
+
+        value = encode(value)
+
+        if value not in self.index:
+            self.index[value] = len(self.strings)
+            self.strings.append(value)
+
+        return self.index[value]
+
+
+def write_dataset(dataset, filename):
+    strings = StringTable()
+    strings.intern(dataset.name)
+
+    instance_ids = []
+    text_offsets = [0]
+    mention_offsets = [0]
+    texts = []
+    columns = dict((name, []) for name, _ in COLUMNS)
+
+    for instance in dataset:
+        text = encode(instance.text)
+        texts.append(text)
+        instance_ids.append(instance.instance_id)
+        text_offsets.append(text_offsets[-1] + len(text))
+        mention_offsets.append(mention_offsets[-1] + len(instance.mentions))
+
+        for m in instance.mentions:
+            columns['start'].append(m.start)
+            columns['end'].append(m.end)
+            columns['wid'].append(m.wid)
+            columns['title'].append(strings.intern(m.title))
+            columns['spot'].append(strings.intern(m.spot))
+            columns['score1'].append(m.score1)
+            columns['score2'].append(m.score2)
+
+    string_offsets = [0]
+
+    for value in strings.strings:
+        string_offsets.append(string_offsets[-1] + len(value))
+
+    with open(filename, 'wb') as output:
+        output.write(HEADER.pack(MAGIC, VERSION, len(instance_ids),
+                                 mention_offsets[-1], len(strings.strings)))
+        output.write(pack('q', instance_ids))
+        output.write(pack('q', text_offsets))
+        output.write(pack('q', mention_offsets))
+
+        for name, fmt in COLUMNS:
+            output.write(pack(fmt, columns[name]))
+
+        output.write(pack('q', string_offsets))
+        output.write(''.join(strings.strings))
+        output.write(''.join(texts))
+
+
+class LazyInstances(object):
+    """
+    Sequence of the instances of a ColumnarDataset built on access
+    """
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return self.dataset.num_instances
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.dataset.instance(i)
+                    for i in xrange(*key.indices(len(self)))]
+
+        if key < 0:
+            key += len(self)
+
+        if not 0 <= key < len(self):
+            raise IndexError("instance index out of range")
+
+        return self.dataset.instance(key)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self.dataset.instance(i)
+
+
+class ColumnarDataset(Dataset):
+    def __init__(self, filename):
+        self.filename = filename
+
+        with open(filename, 'rb') as inputfile:
+            self.data = mmap.mmap(inputfile.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+
+        magic, version, self.num_instances, self.num_mentions, \
+            self.num_strings = HEADER.unpack_from(self.data, 0)
+
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a columnar dataset" % filename)
+
+        n = self.num_instances
+        m = self.num_mentions
+        pos = HEADER.size
+
+        self.ids_pos = pos
+        self.text_offsets_pos = pos = pos + 8 * n
+        self.mention_offsets_pos = pos = pos + 8 * (n + 1)
+        pos += 8 * (n + 1)
+
+        self.column_pos = {}
+
+        for name, fmt in COLUMNS:
+            self.column_pos[name] = pos
+            pos += struct.calcsize(fmt) * m
+
+        self.string_offsets_pos = pos
+        self.strings_pos = pos + 8 * (self.num_strings + 1)
+        self.text_pos = self.strings_pos + \
+            self.read('q', self.string_offsets_pos, self.num_strings, 1)[0]
+        self.strings = {}
+
+        super(ColumnarDataset, self).__init__(self.string(0),
+                                              LazyInstances(self))
+
+    def __getstate__(self):
+        # Materialize the instances when pickling
+        return {'name': self.name, 'instances': list(self.instances)}
+
+    def __setstate__(self, state):
+        self.__class__ = Dataset
+        self.__dict__.update(state)
+
+    def read(self, fmt, pos, start, count):
+        offset = pos + struct.calcsize(fmt) * start
+        return struct.unpack_from('<%d%s' % (count, fmt), self.data, offset)
+
+    def string(self, index):
+        if index == -1:
+            return None
+
+        if index not in self.strings:
+            start, end = self.read('q', self.string_offsets_pos, index, 2)
+            self.strings[index] = self.data[
+                self.strings_pos + start:self.strings_pos + end
+            ].decode('utf8')
+
+        return self.strings[index]
+
+    def instance(self, i):
+        instance_id = self.read('q', self.ids_pos, i, 1)[0]
+        text_start, text_end = self.read('q', self.text_offsets_pos, i, 2)
+        first, last = self.read('q', self.mention_offsets_pos, i, 2)
+
+        text = self.data[self.text_pos + text_start:self.text_pos + text_end]
+        columns = [self.read(fmt, self.column_pos[name], first, last - first)
+                   for name, fmt in COLUMNS]
+
+        mentions = [
+            Mention(self.string(spot), start, end, self.string(title), wid,
+                    score1=score1, score2=score2)
+            for start, end, wid, title, spot, score1, score2 in zip(*columns)
+        ]
+
+        return Instance(text.decode('utf8'), mentions, instance_id)
+
+
+class ResultStore(object):
+    """
+    Append-only columnar store of the mentions produced by an annotator,
+    kept in a single file inside the result directory.
+
+    Each processed instance is appended as a block made of a header
+    (instance id, number of mentions, size of the string blob), the
+    int32 columns start, end, wid, title length and spot length, the
+    float64 columns score1 and score2 and the UTF-8 titles and spots.
+    A title or spot length of -1 stands for None. The index from instance
+    id to block is rebuilt when the store is opened, ignoring an incomplete
+    last block: it is either being written by another process or was cut
+    by an interrupted run, in which case the store truncates it just
+    before appending to the file again.
+
+    A store opened for a shard (see Dataset.shard) appends to its own
+    results.I-of-N.bin file, so that shards can run concurrently on the
+    same directory. The blocks of all the files of the directory are read
+    back together.
+    """
+    FILENAME = 'results.bin'
+    SHARD_FILENAME = 'results.%d-of-%d.bin'
+    BLOCK_HEADER = struct.Struct('<iii')
+    INT_COLUMNS = ('start', 'end', 'wid', 'title_len', 'spot_len')
+    FLOAT_COLUMNS = ('score1', 'score2')
+
+    def __init__(self, directory, shard=None):
+        """
+        @param shard an optional (index, count) tuple
+        """
+        self.directory = directory
+        self.index = {}
+        self.lock = threading.Lock()
+        # Size of the complete blocks of the own file, until first written
+        self.end = None
+
+        if shard is None:
+            self.filename = os.path.join(directory, self.FILENAME)
+        else:
+            self.filename = os.path.join(directory,
+                                         self.SHARD_FILENAME % shard)
+
+        for filename in self.filenames(directory):
+            if filename != self.filename:
+                self.scan(filename)
+
+        # Own blocks are scanned last so that they take precedence
+        if os.path.exists(self.filename):
+            self.end = self.scan(self.filename)
+
+    @staticmethod
+    def filenames(directory):
+        """
+        @return the sorted paths of the store files inside directory
+        """
+        if not os.path.isdir(directory):
+            return []
+
+        return [os.path.join(directory, name)
+                for name in sorted(os.listdir(directory))
+                if name.startswith('results.') and name.endswith('.bin')]
+
+    @staticmethod
+    def exists(directory):
+        return bool(ResultStore.filenames(directory))
+
+    def __contains__(self, instance_id):
+        return instance_id in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def block_size(self, num_mentions, strings_size):
+        return self.BLOCK_HEADER.size + num_mentions * (
+            4 * len(self.INT_COLUMNS) + 8 * len(self.FLOAT_COLUMNS)
+        ) + strings_size
+
+    def scan(self, filename):
+        """
+        Index the complete blocks of a file
+
+        @return the size of the complete blocks
+        """
+        pos = 0
+
+        with open(filename, 'rb') as inputfile:
+            if not os.fstat(inputfile.fileno()).st_size:
+                return pos
+
+            # Only the pages holding the headers are actually read
+            data = mmap.mmap(inputfile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            while pos + self.BLOCK_HEADER.size <= len(data):
+                instance_id, n, strings_size = \
+                    self.BLOCK_HEADER.unpack_from(data, pos)
+                size = self.block_size(n, strings_size)
+
+                if pos + size > len(data):
+                    break
+
+                self.index[instance_id] = (filename, pos)
+                pos += size
+        finally:
+            data.close()
+
+        return pos
+
+    def append(self, instance_id, mentions):
+        columns = dict((name, []) for name in self.INT_COLUMNS)
+        columns.update((name, []) for name in self.FLOAT_COLUMNS)
+        strings = {'title_len': [], 'spot_len': []}
+
+        def add_string(column, value):
+            if value is None:
+                columns[column].append(-1)
+            else:
+                value = encode(value)
+                columns[column].append(len(value))
+                strings[column].append(value)
+
+        for m in mentions:
+            columns['start'].append(m.start)
+            columns['end'].append(m.end)
+            columns['wid'].append(m.wid)
+            columns['score1'].append(m.score1)
+            columns['score2'].append(m.score2)
+            add_string('title_len', m.title)
+            add_string('spot_len', m.spot)
+
+        strings = ''.join(strings['title_len'] + strings['spot_len'])
+        block = [self.BLOCK_HEADER.pack(instance_id, len(mentions),
+                                        len(strings))]
+        block.extend(pack('i', columns[name]) for name in self.INT_COLUMNS)
+        block.extend(pack('d', columns[name]) for name in self.FLOAT_COLUMNS)
+        block.append(strings)
+
+        with self.lock:
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+
+            with open(self.filename, 'ab') as outputfile:
+                # Drop the partial block left by an interrupted run
+                if self.end is not None:
+                    outputfile.truncate(self.end)
+                    self.end = None
+
+                outputfile.seek(0, os.SEEK_END)
+                pos = outputfile.tell()
+                outputfile.write(''.join(block))
+
+            self.index[instance_id] = (self.filename, pos)
+
+    def blocks(self):
+        """
+        Iterate over (instance_id, columns, titles, spots) for the latest
+        block of every instance, sorted by instance id. Columns is a dict
+        of arrays while titles and spots are lists of unicode strings.
+        """
+        # The files are memory-mapped rather than read in memory
+        contents = {}
+
+        try:
+            for item in self.iterate_blocks(contents):
+                yield item
+        finally:
+            for data in contents.values():
+                data.close()
+
+    def iterate_blocks(self, contents):
+        for instance_id in sorted(self.index):
+            filename, pos = self.index[instance_id]
+
+            if filename not in contents:
+                with open(filename, 'rb') as inputfile:
+                    contents[filename] = mmap.mmap(inputfile.fileno(), 0,
+                                                   access=mmap.ACCESS_READ)
+
+            data = contents[filename]
+            _, n, strings_size = self.BLOCK_HEADER.unpack_from(data, pos)
+            pos += self.BLOCK_HEADER.size
+            columns = {}
+
+            for names, typecode, itemsize in (
+                    (self.INT_COLUMNS, 'i', 4), (self.FLOAT_COLUMNS, 'd', 8)):
+                for name in names:
+                    columns[name] = array(typecode)
+                    columns[name].fromstring(data[pos:pos + itemsize * n])
+
+                    if sys.byteorder == 'big':
+                        columns[name].byteswap()
+
+                    pos += itemsize * n
+
+            def read_strings(lengths, pos):
+                values = []
+
+                for length in lengths:
+                    if length == -1:
+                        values.append(None)
+                    else:
+                        values.append(data[pos:pos + length].decode('utf8'))
+                        pos += length
+
+                return values, pos
+
+            titles, pos = read_strings(columns['title_len'], pos)
+            spots, pos = read_strings(columns['spot_len'], pos)
+
+            yield instance_id, columns, titles, spots
+
+    def arrays(self):
+        """
+        Load all the stored mentions as a dict of arrays. The 'instance_id'
+        and 'offsets' arrays delimit the mentions of each instance, that
+        are the ones from offsets[i] to offsets[i + 1].
+        """
+        result = {
+            'instance_id': array('i'),
+            'offsets': array('i', [0]),
+            'title': [],
+            'spot': [],
+        }
+
+        for name in self.INT_COLUMNS[:3]:
+            result[name] = array('i')
+
+        for name in self.FLOAT_COLUMNS:
+            result[name] = array('d')
+
+        if not self.index:
+            return result
+
+        for instance_id, columns, titles, spots in self.blocks():
+            result['instance_id'].append(instance_id)
+            result['offsets'].append(result['offsets'][-1] + len(titles))
+            result['title'].extend(titles)
+            result['spot'].extend(spots)
+
+            for name in self.INT_COLUMNS[:3] + self.FLOAT_COLUMNS:
+                result[name].extend(columns[name])
+
+        return result
+
+    def load_instances(self):
+        instances = []
+
+        if not self.index:
+            return instances
+
+        for instance_id, columns, titles, spots in self.blocks():
+            mentions = [
+                Mention(spot, start, end, title, wid,
+                        score1=score1, score2=score2)
+                for start, end, wid, title, spot, score1, score2 in zip(
+                    columns['start'], columns['end'], columns['wid'],
+                    titles, spots, columns['score1'], columns['score2'])
+            ]
+            instances.append(Instance("", mentions, instance_id))
+
+        return instances
+
+    def export_tsv(self, directory=None):
+        """
+        Write the stored mentions in the per instance TSV layout
+        """
+        for instance in self.load_instances():
+            instance.save_mentions(directory or self.directory)
+
+if __name__ == "__main__":
+    directory = sys.argv[1]
+    store = ResultStore(directory)
+    store.export_tsv()
+
+    print "Exported %d instances from %s" % (len(store), directory)
@@ -1,13 +1,72 @@
+import os
 import json
 from collections import OrderedDict
 from wikibench.dataset import Dataset
 from wikibench.utils import create_annotator, create_experiment
 
+# Parsed gold datasets, shared by all the configurations of the process
+_dataset_cache = {}
+
+
+def load_dataset(filename):
+    key = os.path.abspath(filename)
+
+    if key not in _dataset_cache:
+        if filename.endswith(".bin"):
+            _dataset_cache[key] = Dataset.load_binary(filename)
+        else:
+            _dataset_cache[key] = Dataset.load_tsv(filename)
+
+    return _dataset_cache[key]
+
+
+class LazyMapping(object):
+    """
+    Ordered mapping whose values are built on first access
+    """
+    def __init__(self):
+        self.loaders = OrderedDict()
+        self.values_cache = {}
+
+    def add(self, key, loader):
+        self.loaders[key] = loader
+
+    def __getitem__(self, key):
+        if key not in self.values_cache:
+            self.values_cache[key] = self.loaders[key]()
+        return self.values_cache[key]
+
+    def __contains__(self, key):
+        return key in self.loaders
+
+    def __iter__(self):
+        return iter(self.loaders)
+
+    def __len__(self):
+        return len(self.loaders)
+
+    def keys(self):
+        return self.loaders.keys()
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
 
 class Configurations(object):
-    def __init__(self, conf_file='configurations.json'):
-        self.annotators = OrderedDict()
-        self.datasets = OrderedDict()
+    def __init__(self, conf_file='configurations.json',
+                 only_annotators=None, only_datasets=None):
+        """
+        Annotators and datasets are only instantiated when accessed.
+
+        @param only_annotators if given, the aliases of the annotators to
+                               keep
+        @param only_datasets if given, the names of the datasets to keep
+        """
+        self.annotators = LazyMapping()
+        self.datasets = LazyMapping()
         self.experiments = OrderedDict()
 
         with open(conf_file, 'r') as inputfile:
@@ -16,16 +75,31 @@ class Configurations(object):
             # Load annotators
             for annotator_conf in conf["annotators"]:
                 nickname = annotator_conf["alias"]
-                module_name = annotator_conf["name"]
-                annotator = create_annotator(str(module_name))
-                annotator.set_configuration(annotator_conf["configuration"])
 
-                self.annotators[nickname] = annotator
+                if only_annotators and nickname not in only_annotators:
+                    continue
+
+                def load_annotator(annotator_conf=annotator_conf):
+                    module_name = annotator_conf["name"]
+                    annotator = create_annotator(str(module_name))
+                    annotator.set_configuration(
+                        annotator_conf["configuration"]
+                    )
+                    return annotator
+
+                self.annotators.add(nickname, load_annotator)
 
             # Load datasets
             for dataset_conf in conf["datasets"]:
-                self.datasets[dataset_conf["name"]] = \
-                    Dataset.load_tsv(dataset_conf["file"])
+                name = dataset_conf["name"]
+
+                if only_datasets and name not in only_datasets:
+                    continue
+
+                def load(filename=dataset_conf["file"]):
+                    return load_dataset(filename)
+
+                self.datasets.add(name, load)
 
             # Load experiments
             for exp_conf in conf["experiments"]:
@@ -2,7 +2,8 @@ import os
 import re
 import codecs
 import cPickle as pickle
-from xml.dom import minidom
+from itertools import islice
+from xml.etree.cElementTree import iterparse
 
 
 class Dataset(object):
@@ -14,6 +15,8 @@ class Dataset(object):
         return len(self.instances)
 
     def __getitem__(self, key):
+        if isinstance(key, slice):
+            return Dataset(self.name, SlicedInstances(self.instances, key))
         return Dataset(self.name, [self.instances[key]])
 
     def __iter__(self):
@@ -25,6 +28,33 @@ class Dataset(object):
     def __repr__(self):
         return str(self)
 
+    def shard(self, index, count):
+        """
+        @return a Dataset with every count-th instance starting from the
+                index-th one. The shards 0 ... count - 1 partition the
+                dataset and are deterministic as long as its order is.
+        """
+        if not 0 <= index < count:
+            raise ValueError("Invalid shard %d/%d" % (index, count))
+        return self[index::count]
+
+    @staticmethod
+    def parse_shard(value):
+        """
+        Parse a shard specification in the form i/N, 0 <= i < N
+
+        @return an (i, N) tuple
+        """
+        try:
+            index, count = map(int, value.split('/'))
+        except ValueError:
+            raise ValueError("Invalid shard %s, expected i/N" % value)
+
+        if not 0 <= index < count:
+            raise ValueError("Invalid shard %s, expected 0 <= i < N" % value)
+
+        return (index, count)
+
     @staticmethod
     def save(dataset, filename):
         with open(filename, 'w') as outputfile:
@@ -35,6 +65,16 @@ class Dataset(object):
         with open(filename, 'r') as inputfile:
             return pickle.load(inputfile)
 
+    @staticmethod
+    def save_binary(dataset, filename):
+        from wikibench.columnar import write_dataset
+        write_dataset(dataset, filename)
+
+    @staticmethod
+    def load_binary(filename):
+        from wikibench.columnar import ColumnarDataset
+        return ColumnarDataset(filename)
+
     @staticmethod
     def save_tsv(dataset, directory):
         doc_path = os.path.join(directory, 'documents')
@@ -52,6 +92,11 @@ class Dataset(object):
 
     @staticmethod
     def load_results(directory):
+        from wikibench.columnar import ResultStore
+
+        if ResultStore.exists(directory):
+            return ResultStore(directory).load_instances()
+
         instances = []
         ann_path = os.path.join(directory, 'annotations')
 
@@ -107,47 +152,53 @@ class Dataset(object):
 
     @staticmethod
     def save_xml(dataset, filename):
-        import codecs
-        from xml.dom.minidom import Document
-
-        doc = Document()
-        ds = doc.createElement('dataset')
-        ds.attributes['name'] = dataset.name
-        doc.appendChild(ds)
-
-        for instance in dataset.instances:
-            instance_el = doc.createElement('instance')
-            last = 0
-            text = instance.text
+        """
+        Write the dataset as XML one instance at a time. The output is the
+        same that minidom's writexml would produce for the whole document.
+        """
+        def escape(data):
+            return data.replace("&", "&amp;").replace("<", "&lt;") \
+                       .replace("\"", "&quot;").replace(">", "&gt;")
 
-            # if not isinstance(text, unicode):
-            #     text = text.decode('latin1', 'ignore')
+        with codecs.open(filename, 'w', 'utf8') as output:
+            output.write('<?xml version="1.0" ?>')
+            output.write('<dataset name="%s"' % escape(dataset.name))
+            empty = True
 
-            for m in instance.mentions:
-                instance_el.appendChild(
-                    doc.createTextNode(text[last:m.start])
-                )
+            for instance in dataset.instances:
+                if empty:
+                    output.write('>')
+                    empty = False
 
-                ann = doc.createElement('annotation')
-                ann.attributes['wid'] = str(m.wid)
-                ann.attributes['title'] = m.title
-                ann.appendChild(
-                    doc.createTextNode(text[m.start:m.end])
-                )
-                instance_el.appendChild(ann)
+                parts = ['<instance>']
+                last = 0
+                text = instance.text
 
-                last = m.end
+                for m in instance.mentions:
+                    parts.append(escape(text[last:m.start]))
+                    parts.append('<annotation title="%s" wid="%s">%s'
+                                 '</annotation>' % (
+                                     escape(m.title), escape(str(m.wid)),
+                                     escape(text[m.start:m.end])))
+                    last = m.end
 
-            instance_el.appendChild(doc.createTextNode(text[last:]))
-            ds.appendChild(instance_el)
+                parts.append(escape(text[last:]))
+                parts.append('</instance>')
+                output.write(''.join(parts))
 
-        with codecs.open(filename, 'w', 'utf8') as output:
-            doc.writexml(output)
+            if empty:
+                output.write('/>')
+            else:
+                output.write('</dataset>')
 
 
 class Mention(object):
+    # Mentions are created by the thousands: avoid a __dict__ per instance
+    __slots__ = ('spot', 'start', 'end', 'title', 'wid', 'entities',
+                 'score1', 'score2', 'correct_title')
+
     def __init__(self, spot, start, end, title, wid,
-                 entities=[], score1=1.0, score2=1.0):
+                 entities=(), score1=1.0, score2=1.0):
         """
         @param spot the spot delimited by this mention
         @param start the start index of this mention
@@ -167,6 +218,20 @@ class Mention(object):
         self.score1 = score1
         self.score2 = score2
 
+    def __getstate__(self):
+        state = {}
+
+        for kls in type(self).__mro__:
+            for name in getattr(kls, '__slots__', ()):
+                if hasattr(self, name):
+                    state[name] = getattr(self, name)
+
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def find_matching(self, possible_mentions, strong_match=True):
         """
         Find a possible matching mention from a list of mentions
@@ -249,41 +314,50 @@ class Instance(object):
         return re.sub("\s+", " ", text).strip()
 
     @staticmethod
-    def fromDOM(instance_element, instance_id=0):
-        text = ""
+    def fromElement(instance_element, instance_id=0):
+        """
+        Build an instance from an ElementTree instance element, whose
+        annotation children are the mentions. The text is collected in a
+        list and joined once.
+        """
+        parts = [instance_element.text or u""]
+        length = len(parts[0])
         mentions = []
 
-        for node in instance_element.childNodes:
-            if node.nodeType == node.TEXT_NODE:
-                text += node.data
-            elif node.tagName == "annotation":
-                start = len(text)
-                mention_text = Instance.normalize_spot(node.firstChild.data)
-                text += mention_text
-                end = len(text)
-
-                if node.attributes.get('rank_0_id', None) is not None:
-                    for i in xrange(len(node.attributes) / 3):
+        for node in instance_element:
+            if node.tag == "annotation":
+                start = length
+                mention_text = unicode(Instance.normalize_spot(node.text or ""))
+                parts.append(mention_text)
+                length += len(mention_text)
+                end = length
+
+                if node.get('rank_0_id') is not None:
+                    for i in xrange(len(node.attrib) / 3):
                         try:
-                            title = node.getAttribute("rank_%d_title" % i)
-                            wid = int(node.getAttribute("rank_%d_id" % i))
-                            score = float(node.getAttribute("rank_%d_score" % i))
+                            title = unicode(node.get("rank_%d_title" % i))
+                            wid = int(node.get("rank_%d_id" % i))
+                            score = float(node.get("rank_%d_score" % i))
 
                             mentions.append(
-                                Mention(mention_text, start, end, title, wid, score=score)
+                                Mention(mention_text, start, end, title, wid, score1=score)
                             )
                         except:
                             import sys
-                            print >>sys.stderr, "Malformed instance", node.attributes.keys()
+                            print >>sys.stderr, "Malformed instance", node.attrib.keys()
 
                 else:
-                    title = node.getAttribute("title")
-                    wid = int(node.getAttribute("wid"))
+                    title = unicode(node.get("title", ""))
+                    wid = int(node.get("wid"))
                     mentions.append(
                         Mention(mention_text, start, end, title, wid)
                     )
 
-        return Instance(text, mentions, instance_id)
+            if node.tail:
+                parts.append(node.tail)
+                length += len(node.tail)
+
+        return Instance(u"".join(parts), mentions, instance_id)
 
     def has_been_processed(self, directory):
         ann_path = os.path.join(directory, 'annotations')
@@ -291,32 +365,178 @@ class Instance(object):
 
         return os.path.exists(ann_file)
 
-    def save_mentions(self, directory, mentions=[]):
-        if not mentions:
+    def save_mentions(self, directory, mentions=None):
+        """
+        Save the given mentions (those of the instance by default) in
+        directory, an empty list saving an empty annotation file
+        """
+        if mentions is None:
             mentions = self.mentions
 
         ann_path = os.path.join(directory, 'annotations')
         ann_file = os.path.join(ann_path, "%07d.tsv" % self.instance_id)
 
         if not os.path.exists(ann_path):
-            os.makedirs(ann_path)
+            try:
+                os.makedirs(ann_path)
+            except OSError:
+                # Another worker may have created it in the meantime
+                if not os.path.isdir(ann_path):
+                    raise
 
         with codecs.open(ann_file, 'w', 'utf8') as outputfile:
             for m in mentions:
                 outputfile.write(m.tsv_entry())
 
 
+class MappedInstances(object):
+    """
+    Lazy sequence applying function to every instance of another sequence
+    each time it is iterated
+    """
+    def __init__(self, instances, function):
+        self.instances = instances
+        self.function = function
+
+    def __len__(self):
+        return len(self.instances)
+
+    def __iter__(self):
+        for instance in self.instances:
+            yield self.function(instance)
+
+
+class SlicedInstances(object):
+    """
+    Lazy slice of another sequence of instances. Only the selected
+    instances are materialized, each time the slice is iterated.
+    """
+    def __init__(self, instances, key):
+        self.instances = instances
+        self.key = key
+
+    def indices(self):
+        return self.key.indices(len(self.instances))
+
+    def __len__(self):
+        return len(xrange(*self.indices()))
+
+    def __getitem__(self, key):
+        positions = xrange(*self.indices())
+
+        if isinstance(key, slice):
+            return self.fetch([positions[i] for i in
+                               xrange(*key.indices(len(positions)))])
+
+        return self.fetch([positions[key]])[0]
+
+    def fetch(self, indices):
+        """
+        @return the instances at the given indices of the underlying
+                sequence, iterating it once if it does not support indexing
+        """
+        if hasattr(self.instances, '__getitem__'):
+            return [self.instances[i] for i in indices]
+
+        selected = dict.fromkeys(indices)
+        last = max(indices) if indices else -1
+
+        for i, instance in enumerate(self.instances):
+            if i > last:
+                break
+            if i in selected:
+                selected[i] = instance
+
+        return [selected[i] for i in indices]
+
+    def __iter__(self):
+        start, stop, step = self.key.start, self.key.stop, self.key.step
+
+        # islice handles non negative bounds without knowing the length
+        if (start or 0) >= 0 and (stop is None or stop >= 0) and \
+           (step or 1) > 0:
+            return islice(iter(self.instances), start, stop, step)
+
+        if hasattr(self.instances, '__getitem__'):
+            return iter(self.instances[self.key])
+
+        return iter(list(self.instances)[self.key])
+
+
+class AIDAInstances(object):
+    """
+    Lazy sequence of the instances of an AIDA XML file, parsed again every
+    time it is iterated with a bounded amount of memory
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.count = None
+
+    def __len__(self):
+        if self.count is None:
+            for _ in self:
+                pass
+        return self.count
+
+    def __iter__(self):
+        count = 0
+
+        for _, instance in AIDADataset.iterate(self.filename):
+            count += 1
+            yield instance
+
+        self.count = count
+
+
 class AIDADataset(Dataset):
+    @staticmethod
+    def iterate(filename):
+        """
+        Stream the file yielding a (dataset name, Instance) tuple for every
+        instance element. Parsed elements are discarded as soon as their
+        Instance is built.
+        """
+        name = None
+        instance_id = 0
+        root = None
+
+        for event, element in iterparse(filename, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = element
+                if element.tag == 'dataset' and name is None:
+                    name = unicode(element.get("name", ""))
+                continue
+
+            if element.tag == 'instance':
+                yield name, Instance.fromElement(element, instance_id)
+                instance_id += 1
+                element.clear()
+                root.clear()
+
+    @staticmethod
+    def stream(filename):
+        """
+        @return a Dataset whose instances are read from filename on demand
+        """
+        name = ""
+
+        for event, element in iterparse(filename, events=('start',)):
+            if element.tag == 'dataset':
+                name = unicode(element.get("name", ""))
+                break
+
+        return Dataset(name, AIDAInstances(filename))
+
     @staticmethod
     def read(filename):
-        doc = minidom.parse(filename)
-        dataset = doc.getElementsByTagName("dataset")[0]
-        iterator = enumerate(dataset.getElementsByTagName("instance"))
-
-        return Dataset(dataset.getAttribute("name"), [
-            Instance.fromDOM(instance, instance_id)
-            for instance_id, instance in iterator
-        ])
+        name = ""
+        instances = []
+
+        for name, instance in AIDADataset.iterate(filename):
+            instances.append(instance)
+
+        return Dataset(name, instances)
 
 if __name__ == "__main__":
     import sys
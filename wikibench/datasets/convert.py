@@ -1,3 +1,4 @@
+import os
 from wikibench.dataset import AIDADataset, Dataset
 from wikibench.utils import create_annotator
 
@@ -12,19 +13,28 @@ def reshape_dataset(annotator, src_file_name, output):
     if src_file_name.endswith(".pkl"):
         dataset = Dataset.load(src_file_name)
         needs_reshape = False
+    elif src_file_name.endswith(".bin"):
+        dataset = Dataset.load_binary(src_file_name)
+        needs_reshape = False
+    elif os.path.isdir(src_file_name):
+        dataset = Dataset.load_tsv(src_file_name)
+        needs_reshape = False
     else:
-        dataset = AIDADataset.read(src_file_name)
-
-    print "Dataset loaded: %s" % dataset
+        # Streamed: the file is parsed again each time it is iterated
+        dataset = AIDADataset.stream(src_file_name)
 
     if needs_reshape:
         print "Reshaping dataset using %s" % annotator
-        annotator.reshape(dataset)
+        dataset = annotator.reshape(dataset)
+
+    print "Dataset loaded: %s" % dataset
 
     if output.endswith(".pkl"):
-        Dataset.save(dataset, output)
+        Dataset.save(Dataset(dataset.name, list(dataset)), output)
     elif output.endswith(".xml"):
         Dataset.save_xml(dataset, output)
+    elif output.endswith(".bin"):
+        Dataset.save_binary(dataset, output)
     else:
         Dataset.save_tsv(dataset, output)
 
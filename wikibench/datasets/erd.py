@@ -1,90 +1,226 @@
 import os
-import sys
 import codecs
 import requests
+from bisect import bisect_left
 from itertools import groupby
+from multiprocessing.pool import ThreadPool
 from wikibench.dataset import *
 
 
 class ERDConvert(object):
-    def __init__(self, goldenfile):
-        self.golden = self.read_file(goldenfile)
+    """
+    Convert the ERD gold standard, whose lines are in the form
+    text_id, left, right, freebase id, title, mention, score1, score2 with
+    UTF-8 byte offsets, into a TSV dataset.
+
+    Freebase MIDs are mapped to WIDs and titles through a local mapping
+    file (MID<TAB>WID<TAB>title lines). The MIDs missing from it are
+    resolved once each and appended to the file, so that following
+    conversions do not need the network at all. MIDs that cannot be
+    resolved are not recorded, and so are retried by the next conversion,
+    and their mentions are left out of the dataset.
+    """
+    def __init__(self, goldenfile, mapping_file=None, workers=8):
+        self.goldenfile = goldenfile
+        self.mapping_file = mapping_file
+        self.mapping = {}
+        self.session = requests.Session()
+
+        if mapping_file and os.path.exists(mapping_file):
+            self.load_mapping(mapping_file)
+
+        self.resolve_mids(workers)
 
     def get_wid(self, mid):
-        return requests.get(
+        return self.session.get(
             'http://wikisense.mkapp.it/wiki/freebase/id/' + mid).json()
 
     def get_title(self, wid):
-        title = requests.get(
+        title = self.session.get(
             'http://wikisense.mkapp.it/wiki/title/' + str(wid)).json()
         if not title:
             return ''
         return title
 
-    def export_dataset(self, results, output):
-        instances = []
+    def load_mapping(self, filename):
+        with codecs.open(filename, 'r', 'utf8') as inputfile:
+            for line in inputfile:
+                mid, wid, title = line.rstrip('\r\n').split('\t', 2)
+
+                # Left by older conversions for the unresolved MIDs
+                if int(wid) >= 0:
+                    self.mapping[mid] = (int(wid), title)
+
+    def resolve(self, mid):
+        """
+        @return a (mid, wid, title) tuple, wid being None if the MID could
+                not be resolved
+        """
+        try:
+            wid = self.get_wid(mid)
+
+            if wid is None:
+                return (mid, None, None)
 
-        for docid, (docname, mentions) in enumerate(self.golden):
-            text = codecs.open(
-                os.path.join(results, docname + ".txt"),
-                'r',
-                'utf8'
-            ).read()
+            return (mid, wid, self.get_title(wid))
+        except (requests.RequestException, ValueError), exc:
+            print "Error while resolving %s (%s)" % (mid, str(exc))
+            return (mid, None, None)
 
-            filtered = []
-            prevend = 0
+    def resolve_mids(self, workers=8):
+        """
+        Resolve the distinct MIDs of the gold standard that are not in the
+        mapping yet, using up to workers concurrent requests.
+        """
+        mids = set()
 
-            for m in mentions:
-                cum = 0
-                offsets = []
-                for c in text:
-                    offsets.append(cum)
-                    cum += len(c.encode('utf8'))
+        for line in self.iterate_lines():
+            mids.add(self.get_mid(line[3]))
 
+        mids = sorted(mids.difference(self.mapping))
 
-                m.start = offsets[m.start]
-                m.end = m.start + len(m.spot)#offsets[min(m.end, len(offsets) - 1)]
+        if not mids:
+            return
 
-                shiftback = min(10, max(0, m.start + 1 - prevend))
+        outputfile = None
 
-                while shiftback >= 0 and text[m.start:m.end] != m.spot:
-                    m.start -= 1
-                    m.end -= 1
-                    shiftback -= 1
+        if self.mapping_file:
+            outputfile = codecs.open(self.mapping_file, 'a', 'utf8')
 
-                if text[m.start:m.end] != m.spot:
-                    print docid, type(text), type(m.spot), text[m.start:m.end], '==', m.spot, docname
+        pool = ThreadPool(max(1, workers))
+        unresolved = 0
+
+        try:
+            iterable = pool.imap_unordered(self.resolve, mids)
+
+            for count, (mid, wid, title) in enumerate(iterable, 1):
+                if wid is None:
+                    unresolved += 1
                 else:
-                    filtered.append(m)
-                    prevend = m.end
+                    self.mapping[mid] = (wid, title)
+
+                    if outputfile is not None:
+                        outputfile.write(u"%s\t%d\t%s\n" % (mid, wid, title))
+
+                if count % 1000 == 0 or count == len(mids):
+                    print "Resolved %d/%d MIDs" % (count, len(mids))
+        finally:
+            pool.terminate()
+            pool.join()
+
+            if outputfile is not None:
+                outputfile.close()
+
+        if unresolved:
+            print "WARN: %d MIDs could not be resolved, their mentions " \
+                  "are left out" % unresolved
+
+    @staticmethod
+    def get_mid(fid):
+        return 'm.' + fid[3:]
+
+    @staticmethod
+    def byte_offsets(text):
+        """
+        @return the UTF-8 byte offset at which each character of text starts
+        """
+        offsets = []
+        cum = 0
+
+        for c in text:
+            offsets.append(cum)
+            cum += len(c.encode('utf8'))
+
+        return offsets
+
+    def iterate_lines(self):
+        if not os.path.exists(self.goldenfile):
+            return
+
+        with codecs.open(self.goldenfile, 'r', 'utf8') as inputfile:
+            for line in inputfile:
+                yield line.strip().split('\t')
+
+    def iterate_golden(self):
+        """
+        Stream the gold standard one document at a time as (docname,
+        mentions) pairs
+        """
+        def iterate_mentions():
+            for line in self.iterate_lines():
+                text_id, left, right, fid, title, mention, \
+                    score1, score2 = line
+                yield text_id, mention, int(left), int(right), \
+                    self.get_mid(fid)
+
+        for docname, items in groupby(iterate_mentions(), key=lambda x: x[0]):
+            mentions = []
+
+            # Documents are kept even if none of their MIDs was resolved
+            for _, spot, left, right, mid in items:
+                if mid in self.mapping:
+                    wid, title = self.mapping[mid]
+                    mentions.append(Mention(spot, left, right, title, wid))
+
+            yield docname, mentions
+
+    def convert_instance(self, docid, docname, mentions, results):
+        text = codecs.open(
+            os.path.join(results, docname + ".txt"),
+            'r',
+            'utf8'
+        ).read()
+
+        offsets = self.byte_offsets(text)
+        filtered = []
+        prevend = 0
+
+        for m in mentions:
+            m.start = bisect_left(offsets, m.start)
+            m.end = m.start + len(m.spot)
+
+            shiftback = min(10, max(0, m.start + 1 - prevend))
+
+            while shiftback >= 0 and text[m.start:m.end] != m.spot:
+                m.start -= 1
+                m.end -= 1
+                shiftback -= 1
+
+            if text[m.start:m.end] != m.spot:
+                print docid, type(text), type(m.spot), text[m.start:m.end], '==', m.spot, docname
+            else:
+                filtered.append(m)
+                prevend = m.end
+
+        return Instance(text, filtered, docid)
 
-            instance = Instance(text, filtered, docid)
-            instances.append(instance)
+    def export_dataset(self, results, output):
+        instances = (
+            self.convert_instance(docid, docname, mentions, results)
+            for docid, (docname, mentions) in enumerate(self.iterate_golden())
+        )
 
         dataset = Dataset('ERD', instances)
         Dataset.save_tsv(dataset, output)
 
-    def read_file(self, filename):
-        if not os.path.exists(filename):
-            return [(None, [])]
-
-        def iterate_golden():
-            for line in codecs.open(filename, 'r', 'utf8'):
-                text_id, left, right, fid, title, mention, score1, score2 = line.strip().split('\t')
-                wid = self.get_wid('m.' + fid[3:])
-                title = self.get_title(wid)
-                yield text_id, mention, int(left), int(right), title, wid
 
-        results = []
+if __name__ == "__main__":
+    from optparse import OptionParser
 
-        for docid, items in groupby(iterate_golden(), key=lambda x: x[0]):
-            instances = [Mention(*x[1:]) for x in items]
-            results.append((docid, instances))
+    parser = OptionParser(usage="%prog [options] GOLDEN RESULTS OUTPUT")
+    parser.add_option("-m", "--mapping", dest="mapping", default=None,
+                      metavar="FILE",
+                      help="Local MID<TAB>WID<TAB>title mapping, extended "
+                           "with the MIDs resolved remotely")
+    parser.add_option("-w", "--workers", dest="workers", default=8,
+                      type="int",
+                      help="Number of concurrent requests used to resolve "
+                           "the missing MIDs")
 
-        if not results:
-            return [(None, [])]
+    (options, args) = parser.parse_args()
 
-        return results
+    if len(args) != 3:
+        parser.error("GOLDEN, RESULTS and OUTPUT are required")
 
-conv = ERDConvert(sys.argv[1])
-conv.export_dataset(sys.argv[2], sys.argv[3])
+    conv = ERDConvert(args[0], options.mapping, options.workers)
+    conv.export_dataset(args[1], args[2])
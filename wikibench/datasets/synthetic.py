@@ -0,0 +1,290 @@
+"""
+Synthetic corpus generator for stress and scaling tests.
+
+The gold dataset is made of documents of random words in which spans of one
+to three words are marked as mentions with the given density (probability
+of a mention starting at each word). Entities follow a Zipfian
+distribution over a fixed number of WIDs.
+
+The result directories of a number of synthetic annotators are derived
+from the gold mentions. Each annotator misses some mentions, links others
+to a wrong entity and adds spurious ones, according to its noise level, and
+moves the boundaries of a fraction of its mentions (the overlap rate) so
+that they only overlap the gold ones. Correct mentions tend to score
+higher than wrong ones, so that thresholds are meaningful.
+
+Every document is generated from its own seed, so the corpus is the same
+whatever the order or the number of passes over it, and it is never kept
+in memory as a whole.
+
+    $ python wikibench/datasets/synthetic.py OUTPUT --documents 100000
+
+writes OUTPUT/datasets (TSV and BIN), OUTPUT/results (TSV or columnar) and
+an OUTPUT/configurations.json that can be given to run_experiment.py and
+report_experiment.py.
+"""
+import os
+import json
+import numpy as np
+from wikibench.dataset import Dataset, Instance, Mention
+from wikibench.columnar import ResultStore
+
+
+class CorpusGenerator(object):
+    def __init__(self, documents=1000, words=300, density=0.05,
+                 entities=100000, zipf=1.1, noise=0.2, overlap=0.1,
+                 vocabulary=50000, seed=0):
+        """
+        @param words number of words of each document
+        @param density probability of a mention starting at each word
+        @param entities number of distinct WIDs
+        @param zipf exponent of the Zipfian distribution of the WIDs
+        @param noise fraction of wrong (missing, mislinked or spurious)
+                     mentions of the annotators
+        @param overlap fraction of the annotator mentions whose boundaries
+                       differ from the gold ones
+        """
+        self.documents = documents
+        self.words = words
+        self.density = density
+        self.entities = entities
+        self.noise = noise
+        self.overlap = overlap
+        self.vocabulary = vocabulary
+        self.seed = seed
+
+        weights = 1.0 / np.arange(1, entities + 1) ** zipf
+        self.cdf = np.cumsum(weights / weights.sum())
+
+    def sample_wids(self, rng, size):
+        return np.minimum(np.searchsorted(self.cdf, rng.random_sample(size)),
+                          self.entities - 1) + 1
+
+    @staticmethod
+    def title(wid):
+        return u"Entity %d" % wid
+
+    def document(self, doc):
+        """
+        @return the gold Instance of the doc-th document
+        """
+        rng = np.random.RandomState([self.seed, doc])
+        tokens = [u"w%d" % token for token in
+                  rng.randint(0, self.vocabulary, self.words)]
+        starts = []
+        pos = 0
+
+        for token in tokens:
+            starts.append(pos)
+            pos += len(token) + 1
+
+        text = u" ".join(tokens)
+        begins = rng.random_sample(self.words) < self.density
+        lengths = rng.randint(1, 4, self.words)
+        wids = self.sample_wids(rng, self.words)
+        mentions = []
+        i = 0
+
+        while i < self.words:
+            if not begins[i]:
+                i += 1
+                continue
+
+            last = min(self.words, i + lengths[i]) - 1
+            start = starts[i]
+            end = starts[last] + len(tokens[last])
+            wid = int(wids[i])
+            mentions.append(Mention(text[start:end], start, end,
+                                    self.title(wid), wid))
+            i = last + 1
+
+        return Instance(text, mentions, doc)
+
+    def annotate(self, instance, annotator, noise=None):
+        """
+        @return the mentions returned by the given synthetic annotator on
+                a gold instance
+        """
+        if noise is None:
+            noise = self.noise
+
+        rng = np.random.RandomState([self.seed, instance.instance_id,
+                                     annotator + 1])
+        text = instance.text
+        mentions = []
+
+        def add(start, end, wid, correct):
+            if correct:
+                score = rng.uniform(0.3, 1.0)
+            else:
+                score = rng.uniform(0.0, 0.7)
+
+            mentions.append(Mention(text[start:end], start, end,
+                                    self.title(wid), wid,
+                                    score1=score, score2=rng.random_sample()))
+
+        for m in instance.mentions:
+            draw = rng.random_sample()
+
+            if draw < noise * 0.4:
+                continue
+
+            wid = m.wid
+            correct = True
+
+            if draw < noise * 0.7:
+                wid = int(self.sample_wids(rng, 1)[0])
+                correct = wid == m.wid
+
+            start, end = m.start, m.end
+
+            if rng.random_sample() < self.overlap:
+                start = max(0, start + rng.randint(-3, 4))
+                end = min(len(text), max(start + 1, end + rng.randint(-3, 4)))
+
+            add(start, end, wid, correct)
+
+        spurious = rng.poisson(noise * 0.3 * max(1, len(instance.mentions)))
+
+        for _ in xrange(spurious):
+            if len(text) < 2:
+                break
+
+            start = rng.randint(0, len(text) - 1)
+            end = min(len(text), start + rng.randint(2, 20))
+            add(start, end, int(self.sample_wids(rng, 1)[0]), False)
+
+        mentions.sort(key=lambda x: (x.start, x.end))
+        return mentions
+
+    def __len__(self):
+        return self.documents
+
+    def __iter__(self):
+        for doc in xrange(self.documents):
+            yield self.document(doc)
+
+    def dataset(self, name='synthetic'):
+        return Dataset(name, self)
+
+
+def generate(output, generator, annotators=3, formats=('tsv', 'bin'),
+             results_format='tsv', name='synthetic'):
+    """
+    Write the gold dataset in the given formats, the results of the
+    annotators in results_format ('tsv' or 'columnar') and a configuration
+    file for them. The i-th annotator has a noise level of
+    generator.noise * (i + 1) / annotators.
+
+    @return the path of the configuration file
+    """
+    dataset = generator.dataset(name)
+    datasets_directory = os.path.join(output, 'datasets')
+    results_directory = os.path.join(output, 'results')
+    dataset_file = None
+
+    if not os.path.exists(datasets_directory):
+        os.makedirs(datasets_directory)
+
+    if 'tsv' in formats:
+        dataset_file = os.path.join(datasets_directory, name)
+        Dataset.save_tsv(dataset, dataset_file)
+        print "Saved the TSV dataset in %s" % dataset_file
+
+    if 'bin' in formats:
+        dataset_file = os.path.join(datasets_directory, name + '.bin')
+        Dataset.save_binary(dataset, dataset_file)
+        print "Saved the BIN dataset in %s" % dataset_file
+
+    aliases = ["system%d" % i for i in xrange(annotators)]
+    directories = [os.path.join(results_directory, name, alias)
+                   for alias in aliases]
+    noises = [generator.noise * (i + 1) / annotators
+              for i in xrange(annotators)]
+    stores = None
+
+    if results_format == 'columnar':
+        stores = [ResultStore(directory) for directory in directories]
+
+    for instance in dataset:
+        for i, directory in enumerate(directories):
+            mentions = generator.annotate(instance, i, noises[i])
+
+            if stores is not None:
+                stores[i].append(instance.instance_id, mentions)
+            else:
+                instance.save_mentions(directory, mentions)
+
+    print "Saved the results of %d annotators in %s" % (
+        annotators, results_directory
+    )
+
+    # The annotators of the configuration are never contacted, the results
+    # are already there. Paths are absolute to work from any directory.
+    conf = {
+        "annotators": [
+            {"alias": alias, "name": "wat", "configuration": {}}
+            for alias in aliases
+        ],
+        "datasets": [{"name": name, "file": os.path.abspath(dataset_file)}],
+        "experiments": [{"name": "sa2w",
+                         "file": os.path.abspath(results_directory),
+                         "format": results_format}],
+    }
+    conf_file = os.path.join(output, 'configurations.json')
+
+    with open(conf_file, 'w') as outputfile:
+        json.dump(conf, outputfile, indent=4)
+
+    return conf_file
+
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="%prog [options] OUTPUT")
+    parser.add_option("-n", "--documents", dest="documents", type="int",
+                      default=1000, help="Number of documents")
+    parser.add_option("--words", dest="words", type="int", default=300,
+                      help="Words per document")
+    parser.add_option("--density", dest="density", type="float",
+                      default=0.05,
+                      help="Probability of a mention starting at each word")
+    parser.add_option("--entities", dest="entities", type="int",
+                      default=100000, help="Number of distinct WIDs")
+    parser.add_option("--zipf", dest="zipf", type="float", default=1.1,
+                      help="Exponent of the Zipfian distribution of WIDs")
+    parser.add_option("--noise", dest="noise", type="float", default=0.2,
+                      help="Noise level of the noisiest annotator")
+    parser.add_option("--overlap", dest="overlap", type="float",
+                      default=0.1,
+                      help="Fraction of annotator mentions only "
+                           "overlapping the gold ones")
+    parser.add_option("-a", "--annotators", dest="annotators", type="int",
+                      default=3, help="Number of synthetic annotators")
+    parser.add_option("-f", "--format", dest="formats", action="append",
+                      default=None, choices=["tsv", "bin"], type="choice",
+                      help="Gold dataset format, tsv or bin (can be "
+                           "repeated, default both)")
+    parser.add_option("--results-format", dest="results_format",
+                      default="tsv", choices=["tsv", "columnar"],
+                      type="choice", help="Format of the annotator results")
+    parser.add_option("--name", dest="name", default="synthetic",
+                      help="Name of the dataset")
+    parser.add_option("--seed", dest="seed", type="int", default=0)
+
+    (options, args) = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error("OUTPUT is required")
+
+    generator = CorpusGenerator(options.documents, options.words,
+                                options.density, options.entities,
+                                options.zipf, options.noise, options.overlap,
+                                seed=options.seed)
+
+    conf_file = generate(args[0], generator, options.annotators,
+                         options.formats or ('tsv', 'bin'),
+                         options.results_format, options.name)
+
+    print "Configuration written in %s" % conf_file
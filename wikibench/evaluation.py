@@ -1,3 +1,4 @@
+from bisect import bisect_left
 from itertools import izip_longest
 from wikibench.metrics import Metrics
 
@@ -10,10 +11,23 @@ class Result(object):
         self.missing = missing
         self.excess = excess
         self.correct_title = None
+        self.tp_scores = []
+        self.fp_scores = []
 
     def as_metric(self):
         return self.metric
 
+    def metric_at(self, threshold):
+        """
+        Return the Metrics that would be obtained by discarding all the
+        system mentions scoring less than threshold. Requires the result to
+        be computed by compare_mentions with a score function.
+        """
+        tp = len(self.tp_scores) - bisect_left(self.tp_scores, threshold)
+        fp = len(self.fp_scores) - bisect_left(self.fp_scores, threshold)
+        fn = self.metric.tp + self.metric.fn - tp
+        return Metrics(tp=tp, fp=fp, fn=fn)
+
     def tp(self):
         return len(self.correct)
 
@@ -128,12 +142,73 @@ class Result(object):
         )
 
 
+def match_spans(xa, xb, use_strong_match=True):
+    """
+    Find all the pairs of mentions of xa and xb delimiting the same span
+    (strong match) or overlapping spans (weak match).
+
+    Strong matches are found by hashing the spans of xa while weak matches
+    are found with a sweep over both lists sorted by start offset, so the
+    cost is O((n + m) log(n + m) + k) where k is the number of pairs.
+
+    @return a list of (i, j) tuples of indices into xa and xb
+    """
+    pairs = []
+
+    if use_strong_match:
+        spans = {}
+
+        for i, gold in enumerate(xa):
+            spans.setdefault((gold.start, gold.end), []).append(i)
+
+        for j, result in enumerate(xb):
+            for i in spans.get((result.start, result.end), ()):
+                pairs.append((i, j))
+
+        return pairs
+
+    # Empty mentions never overlap anything
+    events = [(x.start, 0, i) for i, x in enumerate(xa) if x.end > x.start]
+    events.extend((x.start, 1, j) for j, x in enumerate(xb) if x.end > x.start)
+    events.sort()
+
+    active = ([], [])
+    sides = (xa, xb)
+
+    for start, side, idx in events:
+        # Every interval still active on the other side starts before (or
+        # at) this one and ends after its start: they all overlap it.
+        other = 1 - side
+        alive = [k for k in active[other] if sides[other][k].end > start]
+        active[other][:] = alive
+
+        for k in alive:
+            if side == 0:
+                pairs.append((idx, k))
+            else:
+                pairs.append((k, idx))
+
+        active[side].append(idx)
+
+    return pairs
+
+
 def compare_mentions(xa, xb, is_valid,
-                     use_strong_match=True, take_first=True, count_fp=True):
-    correct = set()
-    error = set()
-    missing = set()
-    excess = set()
+                     use_strong_match=True, take_first=True, count_fp=True,
+                     score=None):
+    """
+    Compare the gold mentions xa against the system mentions xb.
+
+    If score is given it must be a function returning the score of a
+    system mention. The returned Result then also records, for every TP,
+    the highest score of a valid system mention and, for every FP, the
+    score of the system mention, so that Result.metric_at() can evaluate
+    any threshold without matching the mentions again.
+    """
+    correct = []
+    error = []
+    missing = []
+    excess = []
 
     error_tag = {}
 
@@ -141,125 +216,126 @@ def compare_mentions(xa, xb, is_valid,
     fp = 0
     fn = 0
 
-    for gold in xa:
-        if use_strong_match:
-            candidates = filter(
-                lambda x: (x.start, x.end) == (gold.start, gold.end),
-                xb
-            )
-        else:
-            candidates = filter(
-                lambda x: x.overlaps(gold),
-                xb
-            )
+    tp_scores = []
+    fp_scores = []
+
+    gold_candidates = [[] for _ in xa]
+    result_candidates = [[] for _ in xb]
 
-        candidates = sorted(candidates,
-                            key=lambda x: (x.start, x.end - x.start))
+    for i, j in match_spans(xa, xb, use_strong_match):
+        gold_candidates[i].append(j)
+        result_candidates[j].append(i)
 
+    for i, gold in enumerate(xa):
         found = False
+        best_score = None
 
-        for result in candidates:
-            if is_valid(result, gold):
+        for j in gold_candidates[i]:
+            if is_valid(xb[j], gold):
                 found = True
+
+                if score is not None:
+                    best_score = max(best_score, score(xb[j]))
             else:
-                error_tag[result] = error_tag.get(result, 0) + 1
+                error_tag[j] = error_tag.get(j, 0) + 1
 
         if not found:
             fn += 1
-            missing.add(gold)
+            missing.append(gold)
         else:
             tp += 1
+            tp_scores.append(best_score)
 
-    for result in xb:
-        if use_strong_match:
-            candidates = filter(
-                lambda x: (x.start, x.end) == (result.start, result.end),
-                xa
-            )
-        else:
-            candidates = filter(
-                lambda x: result.overlaps(x),
-                xa
-            )
-
-        candidates = sorted(candidates,
-                            key=lambda x: (x.start, x.end))
-
+    for j, result in enumerate(xb):
+        candidates = result_candidates[j]
         found = False
 
-        for gold in candidates:
-            if is_valid(result, gold):
+        for i in candidates:
+            if is_valid(result, xa[i]):
                 found = True
-                correct.add(result)
 
-        if not found:
-            if error_tag.get(result, 0) == 1:
-                result.correct_title = candidates[0]
-                error.add(result)
+        if found:
+            correct.append(result)
+            continue
 
-            if candidates or count_fp:
-                fp += 1
-                excess.add(result)
+        if error_tag.get(j, 0) == 1:
+            # A single wrong candidate: this is an error rather than excess
+            result.correct_title = xa[candidates[0]]
+            error.append(result)
+        elif candidates or count_fp:
+            excess.append(result)
+        else:
+            continue
+
+        fp += 1
+
+        if score is not None:
+            fp_scores.append(score(result))
 
     def sortset(x):
         return sorted(x, key=lambda x: (x.start, x.end))
 
-    excess = excess.difference(error)
-
-    # r_tp = len(correct)
     r_fp = len(excess) + len(error)
     r_fn = len(missing)
 
-    # if r_tp != tp:
-    #     print "TP: %d != %d" % (r_tp, tp)
     assert r_fp == fp, "%d != %d" % (r_fp, fp)
     assert r_fn == fn, "%d != %d" % (r_fn, fn)
 
     m = Metrics(tp=tp, fp=fp, fn=fn)
-    return Result(m, *map(sortset, (correct, error, missing, excess)))
+    result = Result(m, *map(sortset, (correct, error, missing, excess)))
 
+    if score is not None:
+        result.tp_scores = sorted(tp_scores)
+        result.fp_scores = sorted(fp_scores)
 
-def cmp_mentions_spot_weak(xa, xb):
+    return result
+
+
+def cmp_mentions_spot_weak(xa, xb, **kwargs):
     return compare_mentions(xa, xb,
                             is_valid=lambda x, y: True,
-                            use_strong_match=False)
+                            use_strong_match=False, **kwargs)
 
 
-def cmp_mentions_spot_strong(xa, xb):
+def cmp_mentions_spot_strong(xa, xb, **kwargs):
     return compare_mentions(xa, xb,
                             is_valid=lambda x, y: True,
-                            use_strong_match=True)
+                            use_strong_match=True, **kwargs)
 
 
-def cmp_mentions_sa2w_weak(xa, xb):
+def cmp_mentions_sa2w_weak(xa, xb, **kwargs):
     return compare_mentions(
         xa, xb,
         is_valid=lambda x, y: x.wid == y.wid or x.title == y.title,
-        use_strong_match=False
+        use_strong_match=False,
+        **kwargs
     )
 
 
-def cmp_mentions_sa2w_strong(xa, xb):
+def cmp_mentions_sa2w_strong(xa, xb, **kwargs):
     return compare_mentions(
         xa, xb,
         is_valid=lambda x, y: x.wid == y.wid or x.title == y.title,
-        use_strong_match=True
+        use_strong_match=True,
+        **kwargs
     )
 
 
-def cmp_mentions_d2w_weak(xa, xb):
+def cmp_mentions_d2w_weak(xa, xb, **kwargs):
     return compare_mentions(
         xa, xb,
         is_valid=lambda x, y: x.wid == y.wid or x.title == y.title,
         use_strong_match=False,
-        count_fp=False
+        count_fp=False,
+        **kwargs
     )
 
 
-def cmp_mentions_d2w_strong(xa, xb):
+def cmp_mentions_d2w_strong(xa, xb, **kwargs):
     return compare_mentions(
         xa, xb,
         is_valid=lambda x, y: x.wid == y.wid or x.title == y.title,
         use_strong_match=True,
-        count_fp=False
+        count_fp=False,
+        **kwargs
     )
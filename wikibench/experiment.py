@@ -1,7 +1,72 @@
+from wikibench.columnar import ResultStore
+from wikibench.instrumentation import Recorder
+
+
+class InstanceProcessor(object):
+    """
+    Apply an annotator method to single instances saving the returned
+    mentions in a result directory, either as TSV files or in a ResultStore.
+    Every call is timed and recorded in the latency files of the directory
+    (see wikibench.instrumentation).
+    """
+    def __init__(self, experiment, directory, method):
+        self.directory = directory
+        self.recorder = Recorder(directory, experiment.shard)
+        self.method = self.recorder.wrap(method)
+        self.store = None
+
+        if experiment.format == 'columnar':
+            self.store = ResultStore(directory, experiment.shard)
+
+    def is_processed(self, instance):
+        if self.store is not None:
+            return instance.instance_id in self.store
+        return instance.has_been_processed(self.directory)
+
+    def __call__(self, instance):
+        mentions = self.method(instance)
+
+        if self.store is not None:
+            self.store.append(instance.instance_id, mentions)
+        else:
+            instance.save_mentions(self.directory, mentions)
+
+    def finish(self):
+        if self.recorder.calls:
+            self.recorder.save_summary()
+            print "Latency %s" % self.recorder.summary()
+
+
 class Experiment(object):
+    # Number of instances concurrently sent to the annotator
+    workers = 1
+    # Either 'tsv' (one file per instance) or 'columnar' (ResultStore)
+    format = 'tsv'
+    # (index, count) of the dataset shard being processed, if any
+    shard = None
+    # Name of the annotator method applied to every instance, None if the
+    # experiment does not process the instances independently
+    annotator_method = None
+
     def __init__(self, *args, **kwargs):
         for k, v in dict(*args, **kwargs).items():
             setattr(self, k, v)
 
     def run(self, dataset, annotator, directory):
+        """
+        Process the whole dataset at once. Only called for the experiments
+        without an annotator_method, the others being run one instance at
+        a time through processor (see wikibench.scheduler).
+        """
         pass
+
+    def processor(self, annotator, directory):
+        """
+        @return an InstanceProcessor applying the method of annotator, or
+                None if the experiment works on whole datasets
+        """
+        if self.annotator_method is None:
+            return None
+
+        return InstanceProcessor(self, directory,
+                                 getattr(annotator, self.annotator_method))
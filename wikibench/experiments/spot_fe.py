@@ -9,7 +9,12 @@ class SpotFEExperiment(Experiment):
         if not os.path.exists(directory):
             os.makedirs(directory)
 
-        file_name = os.path.join(directory, '%s.svmlight' % dataset.name)
+        if self.shard is None:
+            file_name = '%s.svmlight' % dataset.name
+        else:
+            file_name = '%s.%d-of-%d.svmlight' % ((dataset.name,) + self.shard)
+
+        file_name = os.path.join(directory, file_name)
 
         with open(file_name, 'w') as output:
             for instance in dataset:
@@ -0,0 +1,350 @@
+"""
+Local stand-in for the WAT and TagMe services, to exercise the annotators,
+the transport and the caches without network access.
+
+It implements the endpoints used by WATAnnotator (/tag/spot, /tag/tag,
+/tag/disambiguate, /wiki/redirect, /wiki/title, /wiki/disambiguation) and
+by TagMEAnnotator (/tag). Mentions are synthesized deterministically from
+the text: every run of capitalized words is a spot whose entity and
+scores are derived from a hash of its lowercase form. Every WID multiple
+of REDIRECT_EVERY redirects to the following one and every multiple of
+DISAMBIGUATION_EVERY is a disambiguation page.
+
+Responses are delayed according to a latency distribution, given as
+constant:MS, uniform:LOW:HIGH, exponential:MEAN or lognormal:MEDIAN:SIGMA
+(all in milliseconds), plus an optional cost per character of text.
+Failures can be injected with a given probability: HTTP 500, HTTP 429
+with a Retry-After header or requests hanging for a long time.
+
+    $ python wikibench/fakeserver.py --port 9000 --latency lognormal:50:0.5
+
+and point the annotators to it with {"url": "http://localhost:9000"}.
+"""
+import re
+import json
+import math
+import time
+import random
+import urlparse
+import threading
+from zlib import crc32
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+REDIRECT_EVERY = 17
+DISAMBIGUATION_EVERY = 23
+MAX_WID = 1000000
+
+SPOT_RE = re.compile(r"[A-Z]\w*(?:\s+[A-Z]\w*)*", re.UNICODE)
+
+
+def parse_latency(spec):
+    """
+    @return a function sampling a latency in milliseconds from a random
+            generator, following the given distribution specification
+    """
+    args = spec.split(':')
+    kind = args[0]
+
+    try:
+        values = map(float, args[1:])
+
+        if kind == 'constant' and len(values) == 1:
+            return lambda rng: values[0]
+        if kind == 'uniform' and len(values) == 2:
+            return lambda rng: rng.uniform(values[0], values[1])
+        if kind == 'exponential' and len(values) == 1:
+            return lambda rng: rng.expovariate(1.0 / values[0]) \
+                if values[0] > 0 else 0.0
+        if kind == 'lognormal' and len(values) == 2:
+            return lambda rng: rng.lognormvariate(math.log(values[0]),
+                                                  values[1])
+    except ValueError:
+        pass
+
+    raise ValueError("Invalid latency distribution %s" % spec)
+
+
+def entity_of(spot):
+    """
+    @return the deterministic (wid, title, score) of a spot
+    """
+    key = spot.lower().encode('utf8')
+    wid = crc32(key) % MAX_WID + 1
+    score = (crc32(key[::-1]) & 0xffff) / 65535.0
+    return (wid, spot.replace(' ', '_'), score)
+
+
+def find_spots(text):
+    return [(match.start(), match.end())
+            for match in SPOT_RE.finditer(text)]
+
+
+def wat_mention(text, start, end, entities=True):
+    spot = text[start:end]
+    wid, title, score = entity_of(spot)
+    mention = {
+        'spot': spot,
+        'start': start,
+        'end': end,
+        'numTokens': len(spot.split()),
+        'linkProb': round(1.0 - score / 2, 6),
+        'numLinks': 10,
+        'boostedLinks': 10,
+        'ambiguity': 1 + wid % 5,
+        'commonness': round(score, 6),
+    }
+
+    if entities:
+        mention.update({
+            'id': wid,
+            'title': title,
+            'rho': round(score, 6),
+            'globalCoherence': round(score / 2, 6),
+        })
+
+    return mention
+
+
+class FakeServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, latency='constant:0', per_char=0.0,
+                 error_rate=0.0, throttle_rate=0.0, hang_rate=0.0,
+                 hang=300.0, seed=0):
+        """
+        @param latency latency distribution, see parse_latency
+        @param per_char additional milliseconds per character of text
+        @param error_rate probability of answering with HTTP 500
+        @param throttle_rate probability of answering with HTTP 429
+        @param hang_rate probability of waiting hang seconds before
+                         answering
+        """
+        HTTPServer.__init__(self, address, FakeHandler)
+        self.latency = parse_latency(latency)
+        self.per_char = per_char
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.hang_rate = hang_rate
+        self.hang = hang
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.requests = 0
+
+    @property
+    def url(self):
+        return "http://%s:%d" % self.server_address
+
+    def sample(self):
+        """
+        @return an (outcome, latency in ms) tuple for a new request
+        """
+        with self.lock:
+            self.requests += 1
+            draw = self.rng.random()
+            latency = max(0.0, self.latency(self.rng))
+
+        if draw < self.error_rate:
+            return ('error', latency)
+        draw -= self.error_rate
+
+        if draw < self.throttle_rate:
+            return ('throttle', latency)
+        draw -= self.throttle_rate
+
+        if draw < self.hang_rate:
+            return ('hang', latency)
+
+        return ('ok', latency)
+
+    def start(self):
+        """
+        Serve from a background thread
+
+        @return the base URL of the server
+        """
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, value, headers=()):
+        body = json.dumps(value)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+
+        for name, header in headers:
+            self.send_header(name, header)
+
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        body = self.rfile.read(length)
+
+        if 'json' in (self.headers.getheader('Content-Type') or ''):
+            return json.loads(body)
+
+        return dict((key, values[-1].decode('utf8')) for key, values in
+                    urlparse.parse_qs(body, keep_blank_values=True).items())
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def dispatch(self, method):
+        path = urlparse.urlparse(self.path).path.rstrip('/')
+        body = {}
+
+        if method == 'POST':
+            body = self.read_body()
+
+        outcome, latency = self.server.sample()
+        latency += self.server.per_char * len(body.get('text', ''))
+
+        if outcome == 'hang':
+            time.sleep(self.server.hang)
+
+        time.sleep(latency / 1000.0)
+
+        if outcome == 'error':
+            return self.send_json(500, {'error': 'injected failure'})
+
+        if outcome == 'throttle':
+            return self.send_json(429, {'error': 'slow down'},
+                                  [('Retry-After', '1')])
+
+        try:
+            result = self.route(method, path, body)
+        except (KeyError, ValueError), exc:
+            return self.send_json(400, {'error': str(exc)})
+
+        if result is None:
+            return self.send_json(404, {'error': 'not found'})
+
+        if isinstance(result, dict):
+            result['time'] = int(round(latency))
+
+        self.send_json(200, result)
+
+    def route(self, method, path, body):
+        if method == 'POST':
+            if path == '/tag/spot':
+                return self.spot(body)
+            if path == '/tag/tag':
+                return self.annotate(body)
+            if path == '/tag/disambiguate':
+                return self.disambiguate(body)
+            if path == '/tag':
+                return self.tagme(body)
+            return None
+
+        parts = path.split('/')
+
+        if len(parts) != 4 or parts[1] != 'wiki':
+            return None
+
+        wid = int(parts[3])
+
+        if parts[2] == 'redirect':
+            if wid % REDIRECT_EVERY == 0:
+                return wid + 1
+            return wid
+        if parts[2] == 'title':
+            return "Entity_%d" % wid
+        if parts[2] == 'disambiguation':
+            return wid % DISAMBIGUATION_EVERY == 0
+
+        return None
+
+    def spot(self, body):
+        text = body['text']
+        return {'spots': [wat_mention(text, start, end, entities=False)
+                          for start, end in find_spots(text)]}
+
+    def annotate(self, body):
+        text = body['text']
+        return {'annotations': [wat_mention(text, start, end)
+                                for start, end in find_spots(text)]}
+
+    def disambiguate(self, body):
+        text = body['text']
+        return {'annotations': [wat_mention(text, span['start'], span['end'])
+                                for span in body['spans']]}
+
+    def tagme(self, body):
+        text = body['text']
+        annotations = []
+
+        for start, end in find_spots(text):
+            spot = text[start:end]
+            wid, title, score = entity_of(spot)
+            annotations.append({
+                'spot': spot,
+                'start': start,
+                'end': end,
+                'id': wid,
+                'title': title.replace('_', ' '),
+                'rho': round(score, 6),
+            })
+
+        return {'annotations': annotations}
+
+
+if __name__ == "__main__":
+    from optparse import OptionParser
+
+    parser = OptionParser()
+    parser.add_option("--host", dest="host", default="localhost")
+    parser.add_option("-p", "--port", dest="port", type="int", default=9000)
+    parser.add_option("--latency", dest="latency", default="constant:0",
+                      help="Latency distribution: constant:MS, "
+                           "uniform:LOW:HIGH, exponential:MEAN or "
+                           "lognormal:MEDIAN:SIGMA")
+    parser.add_option("--per-char", dest="per_char", type="float",
+                      default=0.0,
+                      help="Additional latency (ms) per character of text")
+    parser.add_option("--error-rate", dest="error_rate", type="float",
+                      default=0.0, help="Probability of an HTTP 500")
+    parser.add_option("--throttle-rate", dest="throttle_rate",
+                      type="float", default=0.0,
+                      help="Probability of an HTTP 429")
+    parser.add_option("--hang-rate", dest="hang_rate", type="float",
+                      default=0.0,
+                      help="Probability of hanging for --hang seconds")
+    parser.add_option("--hang", dest="hang", type="float", default=300.0)
+    parser.add_option("--seed", dest="seed", type="int", default=0)
+
+    (options, args) = parser.parse_args()
+
+    try:
+        server = FakeServer((options.host, options.port), options.latency,
+                            options.per_char, options.error_rate,
+                            options.throttle_rate, options.hang_rate,
+                            options.hang, options.seed)
+    except ValueError, exc:
+        parser.error(str(exc))
+
+    print "Serving on %s" % server.url
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
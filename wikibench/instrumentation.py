@@ -0,0 +1,297 @@
+"""
+Per call instrumentation of the annotators.
+
+Every call to annotate, disambiguate or spot made through a Recorder is
+timed on the client side. The HTTP requests issued while serving the call
+add their payload sizes to it and the annotators report the processing
+time claimed by the service, so that network and service time can be
+told apart.
+
+The calls are appended to a latency TSV file inside the result directory
+with the following columns: instance id, operation, start time (seconds
+since the epoch), wall time (ms), server time (ms, -1 if unknown), request
+bytes, response bytes, text length, number of requests and error flag.
+Running this module on result directories summarizes these files.
+"""
+import os
+import sys
+import json
+import time
+import codecs
+import threading
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+
+# Upper bounds (ms) of the buckets of the wall time histogram
+BUCKETS = (10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+FILENAME = 'latency.tsv'
+SHARD_FILENAME = 'latency.%d-of-%d.tsv'
+SUMMARY_FILENAME = 'latency.json'
+
+_current = threading.local()
+
+
+class Call(object):
+    __slots__ = ('instance_id', 'operation', 'start', 'wall', 'server',
+                 'request_bytes', 'response_bytes', 'text_length',
+                 'requests', 'error')
+
+    def __init__(self, instance_id, operation, start, wall=0.0, server=-1.0,
+                 request_bytes=0, response_bytes=0, text_length=0,
+                 requests=0, error=0):
+        self.instance_id = instance_id
+        self.operation = operation
+        self.start = start
+        self.wall = wall
+        self.server = server
+        self.request_bytes = request_bytes
+        self.response_bytes = response_bytes
+        self.text_length = text_length
+        self.requests = requests
+        self.error = error
+
+    def tsv_entry(self):
+        return u"%d\t%s\t%.6f\t%.3f\t%.3f\t%d\t%d\t%d\t%d\t%d\n" % (
+            self.instance_id, self.operation, self.start, self.wall,
+            self.server, self.request_bytes, self.response_bytes,
+            self.text_length, self.requests, self.error
+        )
+
+    @staticmethod
+    def from_tsv(line):
+        instance_id, operation, start, wall, server, request_bytes, \
+            response_bytes, text_length, requests, error = \
+            line.rstrip('\r\n').split('\t')
+
+        return Call(int(instance_id), operation, float(start), float(wall),
+                    float(server), int(request_bytes), int(response_bytes),
+                    int(text_length), int(requests), int(error))
+
+
+def current_call():
+    """
+    @return the Call being served by this thread, if any
+    """
+    return getattr(_current, 'call', None)
+
+
+def payload_size(value):
+    """
+    Approximate size in bytes of a request body or of its parameters
+    """
+    if value is None:
+        return 0
+
+    if isinstance(value, unicode):
+        return len(value.encode('utf8'))
+
+    if isinstance(value, str):
+        return len(value)
+
+    if isinstance(value, dict):
+        value = value.items()
+    elif not isinstance(value, (list, tuple)):
+        # Numbers and other scalars are sent as their string form
+        return len(str(value))
+
+    size = 0
+
+    # Form encoded key=value pairs separated by &, a list value repeats
+    # its key
+    for k, v in value:
+        for item in (v if isinstance(v, (list, tuple)) else [v]):
+            size += payload_size(k) + payload_size(item) + 2
+
+    return size
+
+
+def record_request(response_bytes, *payloads):
+    """
+    Add an HTTP request with the given payloads (params, data, ...) to the
+    call being served, if any. Sizes are only computed while recording and
+    never make the request fail.
+    """
+    call = current_call()
+
+    if call is None:
+        return
+
+    try:
+        request_bytes = sum(payload_size(payload) for payload in payloads)
+    except Exception:
+        request_bytes = 0
+
+    call.requests += 1
+    call.request_bytes += request_bytes
+    call.response_bytes += response_bytes
+
+
+def record_server_time(milliseconds):
+    call = current_call()
+
+    if call is not None and milliseconds is not None:
+        call.server = max(0.0, call.server) + float(milliseconds)
+
+
+class Recorder(object):
+    """
+    Collect the calls made to an annotator method and append them to the
+    latency file of a result directory
+    """
+    def __init__(self, directory, shard=None):
+        self.directory = directory
+        self.calls = []
+        self.lock = threading.Lock()
+
+        if shard is None:
+            self.filename = os.path.join(directory, FILENAME)
+        else:
+            self.filename = os.path.join(directory, SHARD_FILENAME % shard)
+
+    def wrap(self, method):
+        """
+        @return a function calling method on an instance and recording it
+        """
+        operation = method.__name__
+
+        def call(instance):
+            record = Call(instance.instance_id, operation, time.time(),
+                          text_length=len(instance.text))
+            _current.call = record
+
+            try:
+                return method(instance)
+            except:
+                record.error = 1
+                raise
+            finally:
+                record.wall = (time.time() - record.start) * 1000
+                _current.call = None
+                self.add(record)
+
+        return call
+
+    def add(self, call):
+        with self.lock:
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+
+            with codecs.open(self.filename, 'a', 'utf8') as outputfile:
+                outputfile.write(call.tsv_entry())
+
+            self.calls.append(call)
+
+    def save_summary(self, filename=None):
+        summary = summarize(self.calls)
+
+        with open(filename or self.summary_filename(), 'w') as outputfile:
+            json.dump(summary, outputfile, indent=2, sort_keys=True)
+
+        return summary
+
+    def summary_filename(self):
+        return self.filename[:-len('.tsv')] + '.json'
+
+    def summary(self):
+        return format_summary(summarize(self.calls))
+
+
+def percentiles(values):
+    if not len(values):
+        return dict(('p%d' % p, 0.0) for p in PERCENTILES)
+
+    return dict(('p%d' % p, float(v))
+                for p, v in zip(PERCENTILES,
+                                np.percentile(values, PERCENTILES)))
+
+
+def histogram(values):
+    """
+    @return the number of values falling in each bucket, the last one
+            counting the values above the last bound
+    """
+    counts = np.bincount(np.searchsorted(BUCKETS, values),
+                         minlength=len(BUCKETS) + 1)
+    labels = ['<=%d' % bound for bound in BUCKETS] + ['>%d' % BUCKETS[-1]]
+    return [[label, int(count)] for label, count in zip(labels, counts)]
+
+
+def summarize(calls):
+    """
+    @return a dict mapping every operation to the statistics of its calls
+    """
+    operations = {}
+
+    for operation in sorted(set(call.operation for call in calls)):
+        selected = [call for call in calls if call.operation == operation]
+        wall = np.array([call.wall for call in selected])
+        server = np.array([call.server for call in selected
+                           if call.server >= 0])
+        chars = sum(call.text_length for call in selected)
+        elapsed = max(call.start + call.wall / 1000 for call in selected) - \
+            min(call.start for call in selected)
+
+        operations[operation] = {
+            'calls': len(selected),
+            'errors': sum(call.error for call in selected),
+            'requests': sum(call.requests for call in selected),
+            'request_bytes': sum(call.request_bytes for call in selected),
+            'response_bytes': sum(call.response_bytes for call in selected),
+            'text_length': chars,
+            'elapsed': elapsed,
+            'calls_per_second': len(selected) / elapsed if elapsed else 0.0,
+            'chars_per_second': chars / elapsed if elapsed else 0.0,
+            'wall': percentiles(wall),
+            'server': percentiles(server),
+            'histogram': histogram(wall),
+        }
+
+    return operations
+
+
+def format_summary(summary):
+    messages = []
+
+    for operation, stats in sorted(summary.items()):
+        messages.append(
+            "[%s CALLS: %d ERR: %d %.2f/s WALL p50: %.0f p95: %.0f "
+            "p99: %.0f SERVER p50: %.0f p95: %.0f p99: %.0f ms]" % (
+                operation, stats['calls'], stats['errors'],
+                stats['calls_per_second'],
+                stats['wall']['p50'], stats['wall']['p95'],
+                stats['wall']['p99'], stats['server']['p50'],
+                stats['server']['p95'], stats['server']['p99'])
+        )
+
+    return " ".join(messages)
+
+
+def load_calls(directory):
+    """
+    Load the calls recorded in all the latency files of directory, e.g.
+    by different shards or by interrupted and resumed runs
+    """
+    calls = []
+
+    for name in sorted(os.listdir(directory)):
+        if name.startswith('latency.') and name.endswith('.tsv'):
+            filename = os.path.join(directory, name)
+
+            with codecs.open(filename, 'r', 'utf8') as inputfile:
+                for line in inputfile:
+                    if line.strip():
+                        calls.append(Call.from_tsv(line))
+
+    return calls
+
+if __name__ == "__main__":
+    for directory in sys.argv[1:]:
+        calls = load_calls(directory)
+        summary = summarize(calls)
+
+        with open(os.path.join(directory, SUMMARY_FILENAME), 'w') as output:
+            json.dump(summary, output, indent=2, sort_keys=True)
+
+        print "%s %s" % (directory, format_summary(summary))
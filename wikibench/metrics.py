@@ -1,3 +1,46 @@
+import numpy as np
+
+# Columns of the per document count arrays
+TP, FP, FN, TN = range(4)
+
+
+def safe_ratio(num, denom):
+    """
+    Element-wise num / denom, defined as 0 where denom is 0
+    """
+    num = np.asarray(num, dtype=np.float64)
+    denom = np.asarray(denom, dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denom == 0, 0.0, 1.0 * num / denom)
+
+
+def precision_of(tp, fp):
+    return safe_ratio(tp, np.add(tp, fp))
+
+
+def recall_of(tp, fn):
+    return safe_ratio(tp, np.add(tp, fn))
+
+
+def average(values):
+    """
+    Row-wise mean of a (configurations x documents) array, 0 without
+    documents
+    """
+    if values.shape[1] == 0:
+        return np.zeros(values.shape[0])
+    return values.mean(axis=1)
+
+
+def f1_of(p, r):
+    p = np.asarray(p, dtype=np.float64)
+    r = np.asarray(r, dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(p + r == 0, 0.0, 2 * p * r / (p + r))
+
+
 class Metrics(object):
     def __init__(self, fp=0, fn=0, tp=0, tn=0):
         # Just as recap:
@@ -10,14 +53,28 @@ class Metrics(object):
         self.fn = fn
         self.tp = tp
         self.tn = tn
-        self.metrics = []
+
+        # Per document counts, one row per pushed document. The array
+        # grows geometrically and only the first `size` rows are valid.
+        self.counts = np.zeros((0, 4), dtype=np.int64)
+        self.size = 0
+
+    @property
+    def metrics(self):
+        return [Metrics(tp=tp, fp=fp, fn=fn, tn=tn)
+                for tp, fp, fn, tn in self.documents().tolist()]
+
+    def documents(self):
+        """
+        @return a (documents x 4) array with the TP, FP, FN and TN counts of
+                every pushed document
+        """
+        return self.counts[:self.size]
 
     def clone(self):
         m = Metrics(fp=self.fp, fn=self.fn, tp=self.tp, tn=self.tn)
-        m.metrics = map(
-            lambda x: Metrics(fp=x.fp, fn=x.fn, tp=x.tp, tn=x.tn),
-            self.metrics
-        )
+        m.counts = self.documents().copy()
+        m.size = self.size
         return m
 
     def precision(self, k=1):
@@ -46,29 +103,98 @@ class Metrics(object):
             return 2 * p * r / (p + r)
 
     def has_macro(self):
-        return len(self.metrics) > 0
+        return self.size > 0
 
     def macro_f1(self):
-        if not self.metrics:
+        if not self.size:
             return 0
-        f1_sum = sum(map(lambda x: x.f1(), self.metrics))
-        return float(f1_sum) / len(self.metrics)
+        return float(
+            MetricsMatrix.from_documents(self.documents()).macro_f1()
+        )
 
     def macro_precision(self):
-        if not self.metrics:
+        if not self.size:
             return 0
-        precision_sum = sum(map(lambda x: x.precision(), self.metrics))
-        return float(precision_sum) / len(self.metrics)
+        return float(
+            MetricsMatrix.from_documents(self.documents()).macro_precision()
+        )
 
     def macro_recall(self):
-        if not self.metrics:
+        if not self.size:
             return 0
-        recall_sum = sum(map(lambda x: x.recall(), self.metrics))
-        return float(recall_sum) / len(self.metrics)
+        return float(
+            MetricsMatrix.from_documents(self.documents()).macro_recall()
+        )
+
+    def reserve(self, rows):
+        if self.size + rows > len(self.counts):
+            capacity = max(16, 2 * len(self.counts), self.size + rows)
+            counts = np.zeros((capacity, 4), dtype=np.int64)
+            counts[:self.size] = self.documents()
+            self.counts = counts
 
     def push(self, other):
         self.fp += other.fp
         self.fn += other.fn
         self.tp += other.tp
         self.tn += other.tn
-        self.metrics.append(other)
+
+        self.reserve(1)
+        self.counts[self.size] = (other.tp, other.fp, other.fn, other.tn)
+        self.size += 1
+
+    def merge(self, other):
+        """
+        Add all the documents pushed into other, e.g. by a parallel worker
+        """
+        self.fp += other.fp
+        self.fn += other.fn
+        self.tp += other.tp
+        self.tn += other.tn
+
+        self.reserve(other.size)
+        self.counts[self.size:self.size + other.size] = other.documents()
+        self.size += other.size
+
+
+class MetricsMatrix(object):
+    """
+    Metrics of many configurations (e.g. thresholds) at once. Each argument
+    is a (configurations x documents) array of counts and each method
+    returns an array with one value per configuration, computed as the
+    homonymous Metrics method.
+    """
+    def __init__(self, tp, fp, fn, tn=None):
+        self.tp = np.atleast_2d(tp)
+        self.fp = np.atleast_2d(fp)
+        self.fn = np.atleast_2d(fn)
+
+        if tn is None:
+            self.tn = np.zeros_like(self.tp)
+        else:
+            self.tn = np.atleast_2d(tn)
+
+    @staticmethod
+    def from_documents(documents):
+        return MetricsMatrix(documents[:, TP], documents[:, FP],
+                             documents[:, FN], documents[:, TN])
+
+    def precision(self):
+        return precision_of(self.tp.sum(axis=1), self.fp.sum(axis=1))
+
+    def recall(self):
+        return recall_of(self.tp.sum(axis=1), self.fn.sum(axis=1))
+
+    def f1(self):
+        return f1_of(self.precision(), self.recall())
+
+    def macro_precision(self):
+        return average(precision_of(self.tp, self.fp))
+
+    def macro_recall(self):
+        return average(recall_of(self.tp, self.fn))
+
+    def macro_f1(self):
+        p = precision_of(self.tp, self.fp)
+        r = recall_of(self.tp, self.fn)
+        return average(f1_of(p, r))
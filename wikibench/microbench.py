@@ -0,0 +1,369 @@
+"""
+Microbenchmarks of the evaluation and I/O hot paths.
+
+Every hot path runs on fixed synthetic workloads at several scales, given
+as documents x mentions per document. Each measure runs in a forked
+process, reporting the best wall time over the repetitions and the peak
+memory allocated on top of the workload itself.
+
+Results can be saved as a baseline and later runs compared against it.
+Timings only compare on the same machine, so the baseline is recorded
+locally (e.g. before a change) and never committed:
+
+    $ python wikibench/microbench.py --save microbench.json
+    $ python wikibench/microbench.py --baseline microbench.json
+
+The exit status is 1 when some measure is slower than the baseline by more
+than the given tolerance.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import resource
+import tempfile
+import cPickle as pickle
+from StringIO import StringIO
+from tabulate import tabulate
+from optparse import OptionParser
+from wikibench.dataset import Dataset, Instance, Mention
+from wikibench.evaluation import cmp_mentions_sa2w_weak, \
+    cmp_mentions_sa2w_strong
+from wikibench.experiment import Experiment
+from wikibench.columnar import ResultStore
+from wikibench.metrics import Metrics
+
+# Name -> (documents, mentions per document)
+SCALES = {
+    'tiny': (10, 10),
+    'small': (1000, 10),
+    'medium': (1000, 100),
+    'dense': (10, 10000),
+    'large': (100000, 10),
+}
+
+DEFAULT_SCALES = ('tiny', 'small', 'medium', 'dense')
+
+# Slowdowns smaller than this (seconds) are never regressions
+MIN_DIFFERENCE = 0.01
+
+# Characters between the starts of two consecutive gold mentions
+SPACING = 12
+
+
+def build_workload(documents, mentions, seed=0):
+    """
+    @return (gold, system) lists of instances. The system instances keep
+            most gold mentions, shift or mislabel some and add spurious
+            ones, with random scores.
+    """
+    rng = random.Random(seed)
+    gold = []
+    system = []
+
+    for doc in xrange(documents):
+        text = u"".join(u"entity%05d " % (i % 100000)
+                        for i in xrange(mentions))
+        gmentions = []
+        amentions = []
+
+        for i in xrange(mentions):
+            start = i * SPACING
+            spot = text[start:start + 11]
+            wid = rng.randint(1, 10000)
+            gmentions.append(Mention(spot, start, start + 11,
+                                     u"Title %d" % wid, wid))
+
+            draw = rng.random()
+
+            if draw < 0.1:
+                continue
+            elif draw < 0.2:
+                start += 2
+            elif draw < 0.3:
+                wid += 1
+
+            amentions.append(Mention(text[start:start + 9], start,
+                                     start + 9, u"Title %d" % wid, wid,
+                                     score1=rng.random(),
+                                     score2=rng.random()))
+
+            if draw > 0.95:
+                end = min(len(text), start + SPACING + 3)
+                amentions.append(Mention(text[start + 10:end], start + 10,
+                                         end, u"Spurious", 0,
+                                         score1=rng.random()))
+
+        gold.append(Instance(text, gmentions, doc))
+        system.append(Instance(u"", amentions, doc))
+
+    return gold, system
+
+
+class Workload(object):
+    """
+    Synthetic workload of a scale, with its on disk representations
+    """
+    def __init__(self, name, documents, mentions):
+        self.name = name
+        self.documents = documents
+        self.mentions = mentions
+        self.gold, self.system = build_workload(documents, mentions)
+        self.directory = tempfile.mkdtemp(prefix='microbench-')
+        self.gold_directory = os.path.join(self.directory, 'gold')
+        self.tsv_results = os.path.join(self.directory, 'tsv')
+        self.columnar_results = os.path.join(self.directory, 'columnar')
+
+        Dataset.save_tsv(Dataset('gold', self.gold), self.gold_directory)
+        store = ResultStore(self.columnar_results)
+
+        for instance in self.system:
+            instance.save_mentions(self.tsv_results)
+            store.append(instance.instance_id, instance.mentions)
+
+    def cleanup(self):
+        shutil.rmtree(self.directory)
+
+
+def bench_compare_weak(workload):
+    for g, a in zip(workload.gold, workload.system):
+        cmp_mentions_sa2w_weak(g.mentions, a.mentions)
+
+
+def bench_compare_strong(workload):
+    for g, a in zip(workload.gold, workload.system):
+        cmp_mentions_sa2w_strong(g.mentions, a.mentions)
+
+
+def bench_load_tsv(workload):
+    Dataset.load_tsv(workload.gold_directory)
+
+
+def bench_load_results_tsv(workload):
+    Dataset.load_results(workload.tsv_results)
+
+
+def bench_load_results_columnar(workload):
+    Dataset.load_results(workload.columnar_results)
+
+
+def bench_find_best_threshold(workload):
+    from wikibench.report_experiment import Reporter
+
+    # Skip the command line parsing and the report of Reporter.__init__
+    reporter = Reporter.__new__(Reporter)
+    reporter.use_strong_match = False
+    reporter.best = 'score1'
+    reporter.optimize = 'macro_f1'
+    reporter.all_thresholds = False
+
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+
+    try:
+        reporter.find_best_threshold(Experiment(name='sa2w'),
+                                     workload.system, workload.gold)
+    finally:
+        sys.stdout = stdout
+
+
+def bench_metrics(workload):
+    m = Metrics()
+
+    for doc in xrange(workload.documents):
+        m.push(Metrics(tp=doc % 7, fp=doc % 3, fn=doc % 5))
+
+    m.f1()
+    m.macro_f1()
+    m.macro_precision()
+    m.macro_recall()
+
+
+BENCHMARKS = (
+    ('compare_mentions_weak', bench_compare_weak),
+    ('compare_mentions_strong', bench_compare_strong),
+    ('load_tsv', bench_load_tsv),
+    ('load_results_tsv', bench_load_results_tsv),
+    ('load_results_columnar', bench_load_results_columnar),
+    ('find_best_threshold', bench_find_best_threshold),
+    ('metrics', bench_metrics),
+)
+
+
+def reset_peak():
+    """
+    Reset the peak resident set size of the process, where supported
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as outputfile:
+            outputfile.write('5')
+        return True
+    except IOError:
+        return False
+
+
+def memory_status(field):
+    """
+    @return the given field (e.g. VmRSS) of /proc/self/status in KB
+    """
+    with open('/proc/self/status') as inputfile:
+        for line in inputfile:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+
+    raise KeyError(field)
+
+
+def measure(function, workload, repeat):
+    """
+    @return (best time in seconds, peak memory increase in KB)
+    """
+    try:
+        before = memory_status('VmRSS')
+    except (IOError, KeyError):
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    reset_peak()
+    best = None
+
+    for _ in xrange(repeat):
+        start = time.time()
+        function(workload)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    try:
+        peak = memory_status('VmHWM')
+    except (IOError, KeyError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return (best, max(0, peak - before))
+
+
+def measure_forked(function, workload, repeat):
+    """
+    Run measure in a child process, so that neither the memory nor the
+    caches of a measure affect the following ones
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+
+    if pid == 0:
+        os.close(read_fd)
+        status = 0
+
+        try:
+            result = measure(function, workload, repeat)
+        except Exception, exc:
+            result = exc
+            status = 1
+
+        with os.fdopen(write_fd, 'wb') as outputfile:
+            pickle.dump(result, outputfile, pickle.HIGHEST_PROTOCOL)
+
+        os._exit(status)
+
+    os.close(write_fd)
+
+    with os.fdopen(read_fd, 'rb') as inputfile:
+        result = pickle.load(inputfile)
+
+    os.waitpid(pid, 0)
+
+    if isinstance(result, Exception):
+        raise result
+
+    return result
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-s", "--scale", dest="scales", action="append",
+                      default=None, metavar="NAME",
+                      help="Scale to run, among %s (can be repeated, "
+                           "default %s)" % (
+                               ", ".join(sorted(SCALES)),
+                               ", ".join(DEFAULT_SCALES)))
+    parser.add_option("-b", "--bench", dest="benchmarks", action="append",
+                      default=None, metavar="NAME",
+                      help="Only run the given hot path (can be repeated)")
+    parser.add_option("-r", "--repeat", dest="repeat", type="int",
+                      default=3,
+                      help="Repetitions of every measure, the best one is "
+                           "reported")
+    parser.add_option("--baseline", dest="baseline", default=None,
+                      metavar="FILE", help="Compare with a saved baseline")
+    parser.add_option("--tolerance", dest="tolerance", type="float",
+                      default=1.25,
+                      help="Slowdown ratio over the baseline considered "
+                           "a regression")
+    parser.add_option("--save", dest="save", default=None, metavar="FILE",
+                      help="Save the results as a baseline")
+
+    (options, args) = parser.parse_args()
+
+    scales = options.scales or DEFAULT_SCALES
+
+    for scale in scales:
+        if scale not in SCALES:
+            parser.error("Unknown scale %s" % scale)
+
+    benchmarks = [(name, function) for name, function in BENCHMARKS
+                  if not options.benchmarks or name in options.benchmarks]
+
+    baseline = {}
+
+    if options.baseline is not None:
+        with open(options.baseline) as inputfile:
+            baseline = json.load(inputfile)
+
+    results = {}
+    rows = [["Hot path", "Scale", "Docs", "Mentions", "Time (s)",
+             "Peak (MB)"]]
+
+    if baseline:
+        rows[0].extend(["Baseline (s)", "Ratio", "Status"])
+
+    regressions = 0
+
+    for scale in scales:
+        documents, mentions = SCALES[scale]
+        workload = Workload(scale, documents, mentions)
+
+        try:
+            for name, function in benchmarks:
+                key = "%s/%s" % (name, scale)
+                elapsed, peak = measure_forked(function, workload,
+                                               options.repeat)
+                results[key] = {'time': elapsed, 'peak_kb': peak}
+                rows.append([name, scale, documents, mentions, elapsed,
+                             peak / 1024.0])
+
+                if key in baseline:
+                    previous = baseline[key]['time']
+                    ratio = elapsed / max(previous, 1e-9)
+                    # Ignore the noise of the measures taking a few ms
+                    regression = ratio > options.tolerance and \
+                        elapsed - previous > MIN_DIFFERENCE
+                    regressions += regression and 1 or 0
+                    rows[-1].extend([baseline[key]['time'], ratio,
+                                     regression and "REGRESSION" or ""])
+                elif baseline:
+                    rows[-1].extend(["", "", ""])
+        finally:
+            workload.cleanup()
+
+    print tabulate(rows, headers="firstrow", floatfmt=".3f")
+
+    if options.save is not None:
+        with open(options.save, 'w') as outputfile:
+            json.dump(results, outputfile, indent=2, sort_keys=True)
+
+    if regressions:
+        print "%d measures regressed over the baseline" % regressions
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
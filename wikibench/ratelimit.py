@@ -0,0 +1,205 @@
+"""
+Per host rate limiting and adaptive concurrency for the Transport.
+
+Every host gets a token bucket, refilled at `rate` requests per second up
+to `burst` tokens. When a state directory is given the bucket state is kept
+in a file locked with flock, so that all the processes of the machine
+using the same directory (e.g. the shards of a run) share the budget.
+
+On top of that the number of requests in flight to each host is adjusted
+AIMD style: it grows by one every `limit` successful requests and is
+halved when a request fails, is throttled (HTTP 429 or 503) or takes more
+than `tolerance` times the lowest latency observed for the host.
+"""
+import os
+import time
+import fcntl
+import struct
+import logging
+import threading
+
+STATE = struct.Struct('<dd')
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst=None, filename=None):
+        """
+        @param rate tokens added per second
+        @param burst maximum number of tokens, defaults to rate
+        @param filename optional file shared with other processes
+        """
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, rate))
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.tokens = self.burst
+        self.timestamp = time.time()
+
+    def take(self, tokens, timestamp):
+        """
+        Refill the bucket and try to take a token
+
+        @return the new (tokens, timestamp) state and the seconds to wait
+                before trying again, 0 if the token was taken
+        """
+        now = time.time()
+        tokens = min(self.burst, tokens + (now - timestamp) * self.rate)
+
+        if tokens >= 1.0:
+            return (tokens - 1.0, now, 0.0)
+
+        return (tokens, now, (1.0 - tokens) / self.rate)
+
+    def try_acquire(self):
+        with self.lock:
+            if self.filename is None:
+                self.tokens, self.timestamp, wait = \
+                    self.take(self.tokens, self.timestamp)
+                return wait
+
+            fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0644)
+
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                data = os.read(fd, STATE.size)
+
+                if len(data) == STATE.size:
+                    tokens, timestamp = STATE.unpack(data)
+                else:
+                    tokens, timestamp = self.burst, time.time()
+
+                tokens, timestamp, wait = self.take(tokens, timestamp)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.write(fd, STATE.pack(tokens, timestamp))
+                return wait
+            finally:
+                os.close(fd)
+
+    def acquire(self):
+        """
+        Block until a token is available
+        """
+        while True:
+            wait = self.try_acquire()
+
+            if wait <= 0:
+                return
+
+            time.sleep(wait)
+
+
+class AdaptiveLimit(object):
+    """
+    AIMD limit on the number of concurrent requests
+    """
+    def __init__(self, initial=1, minimum=1, maximum=64, tolerance=2.0):
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.tolerance = tolerance
+        self.in_flight = 0
+        self.min_latency = None
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+
+            self.in_flight += 1
+
+    def release(self, latency, ok=True):
+        with self.condition:
+            self.in_flight -= 1
+
+            if ok and (self.min_latency is None or
+                       latency < self.min_latency):
+                self.min_latency = latency
+
+            congested = not ok or \
+                latency > self.tolerance * self.min_latency
+
+            if congested:
+                now = time.time()
+
+                # Decrease at most once per round trip, the requests already
+                # in flight saw the same congestion
+                if now - self.last_decrease > latency:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self.last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+            self.condition.notify_all()
+
+
+class RateLimiter(object):
+    """
+    Token buckets and adaptive limits of the hosts contacted by a Transport
+    """
+    def __init__(self, rate=None, burst=None, state_directory=None,
+                 adaptive=False, max_concurrency=64, tolerance=2.0):
+        """
+        @param rate requests per second per host, None for no limit
+        @param adaptive whether to adjust the concurrency per host
+        @param max_concurrency upper bound of the adaptive concurrency
+        """
+        self.rate = rate
+        self.burst = burst
+        self.state_directory = state_directory
+        self.adaptive = adaptive
+        self.max_concurrency = max_concurrency
+        self.tolerance = tolerance
+        self.buckets = {}
+        self.limits = {}
+        self.lock = threading.Lock()
+        self.log = logging.getLogger(self.__class__.__name__)
+
+        if state_directory and not os.path.exists(state_directory):
+            os.makedirs(state_directory)
+
+    def bucket(self, host):
+        with self.lock:
+            if host not in self.buckets:
+                filename = None
+
+                if self.state_directory:
+                    filename = os.path.join(
+                        self.state_directory,
+                        host.replace(':', '_') + '.bucket'
+                    )
+
+                self.buckets[host] = TokenBucket(self.rate, self.burst,
+                                                 filename)
+
+            return self.buckets[host]
+
+    def limit(self, host):
+        with self.lock:
+            if host not in self.limits:
+                self.limits[host] = AdaptiveLimit(
+                    maximum=self.max_concurrency, tolerance=self.tolerance
+                )
+
+            return self.limits[host]
+
+    def acquire(self, host):
+        if self.adaptive:
+            self.limit(host).acquire()
+
+        if self.rate:
+            self.bucket(host).acquire()
+
+    def release(self, host, latency, ok=True):
+        if self.adaptive:
+            self.limit(host).release(latency, ok)
+
+    def stats(self):
+        with self.lock:
+            return dict((host, int(limit.limit))
+                        for host, limit in self.limits.items())
+
+    def summary(self):
+        return " ".join("[%s CONCURRENCY: %d]" % item
+                        for item in sorted(self.stats().items()))
@@ -1,13 +1,35 @@
 # encoding: utf8
 
 import os
+import sys
+import numpy as np
+from StringIO import StringIO
+from multiprocessing import Pool
 from itertools import izip_longest
 from tabulate import tabulate
 from optparse import OptionParser
 from wikibench.evaluation import *
 from wikibench.dataset import Dataset, Instance
-from wikibench.metrics import Metrics
+from wikibench.metrics import Metrics, MetricsMatrix
 from wikibench.configurations import Configurations
+from wikibench.significance import bootstrap, randomization_test
+
+
+_reporter = None
+
+
+def report_cell(key):
+    """
+    Evaluate a cell in a pool worker, capturing what it prints
+    """
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+
+    try:
+        result = _reporter.report_cell(*key)
+        return (sys.stdout.getvalue(), result)
+    finally:
+        sys.stdout = stdout
 
 
 class Reporter(object):
@@ -25,6 +47,10 @@ class Reporter(object):
         parser.add_option("--optimize", dest="optimize",
                           default="macro_f1",
                           help="Target attribute to optimize")
+        parser.add_option("--all-thresholds", dest="all_thresholds",
+                          default=False, action="store_true",
+                          help="Look for the best threshold among all the "
+                               "distinct scores instead of a fixed grid")
         parser.add_option("--tablefmt", dest="tablefmt",
                           default="simple",
                           help="Format for the tables")
@@ -34,6 +60,29 @@ class Reporter(object):
         parser.add_option("--detailed", dest="detailed", default=False,
                           action="store_true",
                           help="Print a detailed report for every document")
+        parser.add_option("--bootstrap", dest="bootstrap", default=0,
+                          type="int", metavar="N",
+                          help="Report bootstrap confidence intervals of "
+                               "F1 computed over N resamples")
+        parser.add_option("--confidence", dest="confidence", default=0.95,
+                          type="float",
+                          help="Confidence level of the intervals")
+        parser.add_option("--significance", dest="significance", default=0,
+                          type="int", metavar="N",
+                          help="Compare every pair of annotators with a "
+                               "paired randomization test of N trials")
+        parser.add_option("-j", "--jobs", dest="jobs", default=1,
+                          type="int",
+                          help="Number of processes used to evaluate the "
+                               "cells and to compute the statistics")
+        parser.add_option("--only-annotator", dest="only_annotators",
+                          action="append", default=None, metavar="ALIAS",
+                          help="Only consider the given annotator "
+                               "(can be repeated)")
+        parser.add_option("--only-dataset", dest="only_datasets",
+                          action="append", default=None, metavar="NAME",
+                          help="Only consider the given dataset "
+                               "(can be repeated)")
 
         (options, args) = parser.parse_args()
 
@@ -43,14 +92,42 @@ class Reporter(object):
         self.best = options.best
         self.threshold = options.threshold
         self.optimize = options.optimize
+        self.all_thresholds = options.all_thresholds
         self.tablefmt = options.tablefmt
-        self.conf = conf = Configurations(options.configuration)
+        self.bootstrap = options.bootstrap
+        self.confidence = options.confidence
+        self.significance = options.significance
+        self.jobs = options.jobs
+        self.conf = conf = Configurations(
+            options.configuration,
+            only_annotators=options.only_annotators,
+            only_datasets=options.only_datasets
+        )
 
         if self.threshold > 0.0 and self.best is None:
             print "You did specify a threshold without best."
             self.threshold = 0.0
 
-        for experiment_name, experiment in conf.experiments.items():
+        self.pool = None
+
+        if self.jobs > 1:
+            # Workers are forked after the gold datasets are loaded, so they
+            # inherit them instead of receiving them with every task
+            conf.datasets.values()
+
+            global _reporter
+            _reporter = self
+            self.pool = Pool(self.jobs)
+
+        try:
+            self.report()
+        finally:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+
+    def report(self):
+        for experiment_name, experiment in self.conf.experiments.items():
             rows = [[
                 u"Dataset",
                 u"Annotator",
@@ -71,38 +148,112 @@ class Reporter(object):
                 rows[-1].insert(2, "Threshold")
                 rows[-1].insert(2, "Attr")
 
-            for dataset_name, dataset in conf.datasets.items():
-                for annotator_name, annotator in conf.annotators.items():
-                    result_directory = os.path.join(
-                        experiment.file, dataset_name, annotator_name
+            if self.bootstrap:
+                rows[-1].extend([u"μF1 CI", u"F1 CI"])
+
+            cells = []
+            keys = [(experiment_name, dataset_name, annotator_name)
+                    for dataset_name in self.conf.datasets
+                    for annotator_name in self.conf.annotators]
+
+            for key, (t, m) in zip(keys, self.report_cells(keys)):
+                _, dataset_name, annotator_name = key
+
+                rows.append([
+                    dataset_name,
+                    annotator_name,
+                    m.tp + m.fn,
+                    m.tp,
+                    m.tn,
+                    m.fp,
+                    m.fn,
+                    m.precision(),
+                    m.recall(),
+                    m.f1(),
+                    m.macro_precision(),
+                    m.macro_recall(),
+                    m.macro_f1()
+                ])
+
+                if self.best or self.threshold:
+                    rows[-1].insert(2, t)
+                    rows[-1].insert(2, self.best)
+
+                if self.bootstrap:
+                    intervals = bootstrap(
+                        m.documents(), ('f1', 'macro_f1'),
+                        self.bootstrap, self.confidence, self.jobs,
+                        pool=self.pool
                     )
-                    results = Dataset.load_results(result_directory)
-                    t, m = self.report_for(experiment,
-                                           results, dataset.instances)
-
-                    rows.append([
-                        dataset_name,
-                        annotator_name,
-                        m.tp + m.fn,
-                        m.tp,
-                        m.tn,
-                        m.fp,
-                        m.fn,
-                        m.precision(),
-                        m.recall(),
-                        m.f1(),
-                        m.macro_precision(),
-                        m.macro_recall(),
-                        m.macro_f1()
+                    rows[-1].extend([
+                        "%.3f-%.3f" % intervals['f1'],
+                        "%.3f-%.3f" % intervals['macro_f1'],
                     ])
 
-                    if self.best or self.threshold:
-                        rows[-1].insert(2, t)
-                        rows[-1].insert(2, self.best)
+                cells.append((dataset_name, annotator_name, m))
 
             print tabulate(rows, headers="firstrow",
                            floatfmt=".3f", tablefmt=self.tablefmt)
 
+            if self.significance:
+                self.report_significance(cells)
+
+    def report_cell(self, experiment_name, dataset_name, annotator_name):
+        experiment = self.conf.experiments[experiment_name]
+        dataset = self.conf.datasets[dataset_name]
+        result_directory = os.path.join(
+            experiment.file, dataset_name, annotator_name
+        )
+        results = Dataset.load_results(result_directory)
+        return self.report_for(experiment, results, dataset.instances)
+
+    def report_cells(self, keys):
+        """
+        Compute the (threshold, metrics) of every (experiment, dataset,
+        annotator) cell, in order. With more than one job the cells are
+        distributed over the process pool and their messages are printed
+        in the original order once all the cells are done.
+        """
+        if self.pool is None:
+            return [self.report_cell(*key) for key in keys]
+
+        results = []
+
+        for output, result in self.pool.map(report_cell, keys):
+            sys.stdout.write(output)
+            results.append(result)
+
+        return results
+
+    def report_significance(self, cells):
+        """
+        Compare every pair of annotators evaluated on the same dataset
+        with a paired approximate randomization test on self.optimize
+        """
+        rows = [[
+            u"Dataset",
+            u"Annotator A",
+            u"Annotator B",
+            u"Metric",
+            u"A - B",
+            u"p-value",
+        ]]
+
+        for i, (dataset_a, name_a, m_a) in enumerate(cells):
+            for dataset_b, name_b, m_b in cells[i + 1:]:
+                if dataset_a != dataset_b:
+                    continue
+
+                diff, pvalue = randomization_test(
+                    m_a.documents(), m_b.documents(), self.optimize,
+                    self.significance, self.jobs, pool=self.pool
+                )
+                rows.append([dataset_a, name_a, name_b,
+                             self.optimize, diff, pvalue])
+
+        print tabulate(rows, headers="firstrow",
+                       floatfmt=".3f", tablefmt=self.tablefmt)
+
     def report_for(self, experiment, actual_instances, golden_instances):
         methname = "cmp_mentions_%s_%s" % (
             experiment.name,
@@ -147,66 +298,79 @@ class Reporter(object):
 
     def find_best_threshold(self, experiment,
                             actual_instances, golden_instances):
-
-        ranges = [1/128.0 * i for i in range(0, 129)]
-
-        best = 0
-        best_value = 0
-
-        for threshold in ranges:
-            filtered_instances = self.threshold_instances(
-                threshold, actual_instances
-            )
-
-            metric = self.evaluate(
-                experiment, golden_instances, filtered_instances
-            )
-
-            value = getattr(metric, self.optimize)()
-
-            # print threshold, value
-
-            if value >= best_value:
-                best_value = value
-                best = threshold
-
-        print "Thr: %3f Value: %.3f" % (best, best_value)
-
-        instances = self.threshold_instances(
-            best, actual_instances
-        )
-
-        return (best, instances)
-
-    def evaluate(self, experiment, golden_instances, actual_instances):
+        """
+        Match every document once keeping track of the scores of the
+        TP and FP contributions and then evaluate each candidate threshold
+        by simply counting the contributions scoring above it.
+        """
         methname = "cmp_mentions_%s_%s" % (
             experiment.name,
             self.use_strong_match and "strong" or "weak"
         )
         compare = globals()[methname]
+        score = lambda x: getattr(x, self.best)
 
-        m = Metrics()
+        results = []
         iterable = izip_longest(golden_instances, actual_instances)
 
         for ginstance, ainstance in iterable:
             if not ainstance:
-                m.push(Metrics(fn=len(ginstance.mentions)))
+                results.append((ginstance, None))
                 continue
 
             assert ginstance.instance_id == ainstance.instance_id
-            gm = ginstance.mentions
-            am = ainstance.mentions
+            result = compare(ginstance.mentions, ainstance.mentions,
+                             score=score)
+            results.append((ginstance, result))
 
-            result = compare(gm, am)
+        if self.all_thresholds:
+            ranges = set([0.0])
 
-            if self.print_report:
-                result.full_report(ginstance.instance_id)
-            if self.print_recap:
-                print "%20s\t%s" % (ginstance.instance_id, result.summary())
+            for ainstance in actual_instances:
+                ranges.update(map(score, ainstance.mentions))
 
-            m.push(result.as_metric())
+            ranges = sorted(ranges)
+        else:
+            ranges = [1/128.0 * i for i in range(0, 129)]
+
+        best = 0
+        best_value = 0
+
+        # Evaluate the thresholds in chunks to bound the memory used by the
+        # (thresholds x documents) count matrices
+        for chunk in xrange(0, len(ranges), 256):
+            thresholds = np.array(ranges[chunk:chunk + 256])
+            shape = (len(thresholds), len(results))
+            tp = np.zeros(shape, dtype=np.int64)
+            fp = np.zeros(shape, dtype=np.int64)
+            fn = np.zeros(shape, dtype=np.int64)
+
+            for doc, (ginstance, result) in enumerate(results):
+                if result is None:
+                    fn[:, doc] = len(ginstance.mentions)
+                    continue
+
+                tp[:, doc] = len(result.tp_scores) - np.searchsorted(
+                    result.tp_scores, thresholds)
+                fp[:, doc] = len(result.fp_scores) - np.searchsorted(
+                    result.fp_scores, thresholds)
+                fn[:, doc] = result.metric.tp + result.metric.fn - tp[:, doc]
+
+            matrix = MetricsMatrix(tp, fp, fn)
+            values = getattr(matrix, self.optimize)()
+
+            for threshold, value in zip(ranges[chunk:chunk + 256], values):
+                if value >= best_value:
+                    best_value = value
+                    best = threshold
 
-        return m
+        print "Thr: %3f Value: %.3f" % (best, best_value)
+
+        instances = self.threshold_instances(
+            best, actual_instances
+        )
+
+        return (best, instances)
 
     def threshold_instances(self, threshold, actual_instances):
         instances = []
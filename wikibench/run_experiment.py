@@ -1,5 +1,12 @@
 import os
+import sys
 from optparse import OptionParser
+from wikibench.cache import ResponseCache
+from wikibench.dataset import Dataset
+from wikibench.annotator import Annotator
+from wikibench.transport import Transport
+from wikibench.ratelimit import RateLimiter
+from wikibench.scheduler import Cell, Scheduler
 from wikibench.configurations import Configurations
 
 
@@ -8,25 +15,154 @@ def main():
     parser.add_option("-c", "--conf", dest="configuration",
                       help="Configuration file in json format", metavar="FILE",
                       default="configurations.json")
+    parser.add_option("-w", "--workers", dest="workers", type="int",
+                      default=None,
+                      help="Number of concurrent requests per annotator")
+    parser.add_option("--rate", dest="rate", type="float", default=None,
+                      help="Maximum number of requests per second sent to "
+                           "each annotator host")
+    parser.add_option("--burst", dest="burst", type="int", default=None,
+                      help="Number of requests that can exceed --rate in a "
+                           "burst (defaults to the rate)")
+    parser.add_option("--rate-state", dest="rate_state", default=None,
+                      metavar="DIR",
+                      help="Share the --rate budget with the other "
+                           "processes using the same DIR")
+    parser.add_option("--adaptive", dest="adaptive", default=False,
+                      action="store_true",
+                      help="Adapt the concurrent requests to each host, up "
+                           "to --workers (required), to its latency and "
+                           "errors")
+    parser.add_option("--cache", dest="cache", default=None, metavar="FILE",
+                      help="Cache the annotator responses in FILE")
+    parser.add_option("--cache-size", dest="cache_size", type="int",
+                      default=None,
+                      help="Maximum size of the response cache in MB")
+    parser.add_option("--replay", dest="replay", default=False,
+                      action="store_true",
+                      help="Only use cached responses, never contact "
+                           "the annotators")
+    parser.add_option("--title-cache", dest="title_cache", default=None,
+                      metavar="FILE",
+                      help="Persistent title to WID cache (see wikiapi.py)")
+    parser.add_option("--only-annotator", dest="only_annotators",
+                      action="append", default=None, metavar="ALIAS",
+                      help="Only consider the given annotator "
+                           "(can be repeated)")
+    parser.add_option("--only-dataset", dest="only_datasets",
+                      action="append", default=None, metavar="NAME",
+                      help="Only consider the given dataset "
+                           "(can be repeated)")
+    parser.add_option("--shard", dest="shard", default=None, metavar="i/N",
+                      help="Only process the i-th of N disjoint shards of "
+                           "every dataset (0 <= i < N)")
+
+    parser.add_option("--schedule", dest="schedule", default="interleaved",
+                      type="choice", choices=["interleaved", "sequential"],
+                      help="Either interleave the instances of all the "
+                           "cells or run the cells one after the other")
+    parser.add_option("--threads", dest="threads", type="int", default=None,
+                      help="Maximum number of instances processed at the "
+                           "same time over all the cells")
+    parser.add_option("--no-journal", dest="journal", default=True,
+                      action="store_false",
+                      help="Do not journal the completed instances in the "
+                           "output directories, nor skip those of "
+                           "previous runs")
+    parser.add_option("--progress", dest="progress", type="int", default=30,
+                      metavar="SECONDS",
+                      help="Seconds between progress reports")
 
     (options, args) = parser.parse_args()
 
-    conf = Configurations(options.configuration)
+    shard = None
+
+    if options.shard is not None:
+        try:
+            shard = Dataset.parse_shard(options.shard)
+        except ValueError, exc:
+            parser.error(str(exc))
+
+    # The concurrency can only adapt between one and the workers
+    if options.adaptive and (options.workers or 1) <= 1:
+        parser.error("--adaptive requires --workers greater than 1")
+
+    limiter = None
+
+    if options.rate is not None or options.adaptive:
+        limiter = RateLimiter(options.rate, options.burst, options.rate_state,
+                              adaptive=options.adaptive,
+                              max_concurrency=max(1, options.workers or 1))
+
+    if options.workers is not None or limiter is not None:
+        Annotator.transport = Transport(
+            pool_size=max(1, options.workers or 10), limiter=limiter
+        )
+
+    if options.replay and options.cache is None:
+        parser.error("--replay requires --cache")
+
+    if options.cache is not None:
+        max_size = options.cache_size
+
+        if max_size is not None:
+            max_size *= 1024 * 1024
+
+        try:
+            Annotator.cache = ResponseCache(options.cache, max_size,
+                                            options.replay)
+        except IOError, exc:
+            parser.error(str(exc))
+
+    if options.title_cache is not None:
+        from wikibench.wikiapi import set_cache
+        set_cache(options.title_cache)
+
+    conf = Configurations(options.configuration,
+                          only_annotators=options.only_annotators,
+                          only_datasets=options.only_datasets)
+
+    cells = []
 
     for experiment_name, experiment in conf.experiments.items():
-        for dataset_name, dataset in conf.datasets.items():
-            for annotator_name, annotator in conf.annotators.items():
+        if options.workers is not None:
+            experiment.workers = options.workers
+
+        experiment.shard = shard
+
+        for dataset_name in conf.datasets:
+            dataset = conf.datasets[dataset_name]
+
+            if shard is not None:
+                dataset = dataset.shard(*shard)
+
+            for annotator_name in conf.annotators:
+                annotator = conf.annotators[annotator_name]
                 output_directory = os.path.join(
                     experiment.file,
                     dataset_name,
                     annotator_name
                 )
 
-                print "Running %s on %s using %s" % (
-                    experiment_name, dataset_name, annotator_name
-                )
+                cells.append(Cell(experiment_name, experiment,
+                                  dataset_name, dataset,
+                                  annotator_name, annotator,
+                                  output_directory, shard, options.journal))
+
+    scheduler = Scheduler(cells,
+                          interleave=options.schedule == 'interleaved',
+                          threads=options.threads,
+                          interval=options.progress)
+    failed = scheduler.run()
+
+    # The transport and the cache are shared by all the cells
+    print "Transport %s" % Annotator.transport.summary()
+
+    if Annotator.cache is not None:
+        print "Cache %s" % Annotator.cache.summary()
 
-                experiment.run(dataset, annotator, output_directory)
+    if failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,441 @@
+"""
+Scheduler of the (experiment, dataset, annotator) cells of a run.
+
+Every cell is expanded into one task per instance. Tasks are dispatched to
+a pool of threads either cell after cell or interleaving the cells, always
+picking the cell with the fewest tasks in flight so that a slow annotator
+only delays its own cells. Each cell keeps at most experiment.workers tasks
+in flight.
+
+Completed tasks are appended to the journal of the cell, a text file
+inside its output directory with a cell<TAB>instance id line per task and
+a cell<TAB>* line once the cell is completed, so that an interrupted run
+restarts where it stopped without looking at the results again. Moving or
+deleting the results takes the journal along. Experiments that do not
+process instances independently (e.g. the feature extraction ones) are
+run as a single task.
+"""
+import os
+import sys
+import time
+import codecs
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+COMPLETED = '*'
+
+JOURNAL_FILENAME = 'run.journal'
+SHARD_JOURNAL_FILENAME = 'run.%d-of-%d.journal'
+
+FORMAT = '%(levelname)s - %(name)s - %(message)s'
+logging.basicConfig(format=FORMAT)
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "?"
+
+    seconds = int(seconds)
+
+    if seconds >= 3600:
+        return "%dh%02dm" % (seconds / 3600, seconds % 3600 / 60)
+
+    return "%dm%02ds" % (seconds / 60, seconds % 60)
+
+
+class Journal(object):
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.outputfile = None
+
+        if filename is None:
+            return
+
+        if os.path.exists(filename):
+            with codecs.open(filename, 'r', 'utf8') as inputfile:
+                for line in inputfile:
+                    # A line truncated by an interruption is ignored
+                    if not line.endswith('\n'):
+                        break
+
+                    key, value = line.rstrip('\n').split('\t')
+                    self.entries.setdefault(key, set()).add(value)
+
+    def __contains__(self, item):
+        key, value = item
+        return str(value) in self.entries.get(key, ())
+
+    def count(self, key):
+        return len(self.entries.get(key, ())) - \
+            ((key, COMPLETED) in self and 1 or 0)
+
+    def record(self, key, value):
+        with self.lock:
+            self.entries.setdefault(key, set()).add(str(value))
+
+            if self.filename is None:
+                return
+
+            # Opened on the first record, the directory may not exist yet
+            if self.outputfile is None:
+                directory = os.path.dirname(self.filename)
+
+                if directory and not os.path.exists(directory):
+                    os.makedirs(directory)
+
+                self.outputfile = codecs.open(self.filename, 'a', 'utf8')
+
+            self.outputfile.write(u"%s\t%s\n" % (key, value))
+            self.outputfile.flush()
+
+    def close(self):
+        with self.lock:
+            if self.outputfile is not None:
+                self.outputfile.close()
+                self.outputfile = None
+
+
+class Cell(object):
+    def __init__(self, experiment_name, experiment, dataset_name, dataset,
+                 annotator_name, annotator, directory, shard=None,
+                 journal=True):
+        """
+        @param shard the (index, count) tuple of a sharded run, which keeps
+                     its own journal
+        @param journal whether to journal the completed tasks
+        """
+        self.experiment_name = experiment_name
+        self.experiment = experiment
+        self.dataset_name = dataset_name
+        self.dataset = dataset
+        self.annotator_name = annotator_name
+        self.annotator = annotator
+        self.directory = directory
+        self.key = "%s/%s/%s" % (experiment_name, dataset_name,
+                                 annotator_name)
+
+        filename = None
+
+        if journal and shard is None:
+            filename = os.path.join(directory, JOURNAL_FILENAME)
+        elif journal:
+            filename = os.path.join(directory, SHARD_JOURNAL_FILENAME % shard)
+
+        self.journal = Journal(filename)
+
+        self.processor = None
+        self.pending = None
+        self.total = 0
+        self.done = 0
+        self.done_now = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.exhausted = False
+        self.closed = False
+        self.started = None
+
+    def __str__(self):
+        return "%s on %s using %s" % (self.experiment_name,
+                                      self.dataset_name, self.annotator_name)
+
+    @property
+    def capacity(self):
+        return max(1, self.experiment.workers)
+
+    @property
+    def completed(self):
+        return (self.key, COMPLETED) in self.journal
+
+    def start(self):
+        self.started = time.time()
+        self.processor = self.experiment.processor(self.annotator,
+                                                   self.directory)
+
+        if self.processor is None:
+            self.total = 1
+            self.pending = iter([None])
+            return
+
+        self.total = len(self.dataset)
+        self.done = self.journal.count(self.key)
+        self.pending = (
+            instance for instance in self.dataset
+            if (self.key, instance.instance_id) not in self.journal
+        )
+
+    def next_task(self):
+        """
+        @return the next instance to process, skipping those already
+                processed by a previous run, or False once there are none
+        """
+        for instance in self.pending:
+            if instance is None or not self.processor.is_processed(instance):
+                return instance
+
+            self.done += 1
+
+        self.exhausted = True
+        return False
+
+    def run_task(self, instance):
+        if instance is None:
+            self.experiment.run(self.dataset, self.annotator, self.directory)
+        else:
+            self.processor(instance)
+
+    @property
+    def finished(self):
+        return self.exhausted and self.in_flight == 0
+
+    def eta(self):
+        elapsed = time.time() - self.started
+
+        if not self.done_now or not elapsed:
+            return None
+
+        return (self.total - self.done) * elapsed / self.done_now
+
+    def progress(self):
+        elapsed = time.time() - self.started
+        rate = elapsed and self.done_now / elapsed or 0.0
+
+        return "%s %d/%d (%.1f%%) %.2f/s ETA %s%s" % (
+            self, self.done, self.total,
+            self.total and 100.0 * self.done / self.total or 100.0,
+            rate, format_duration(self.eta()),
+            self.failed and " FAILED: %d" % self.failed or ""
+        )
+
+
+class Scheduler(object):
+    def __init__(self, cells, interleave=True, threads=None,
+                 interval=30, on_finish=None):
+        """
+        @param threads size of the pool, by default the sum of the workers
+                       of the cells that can run at the same time
+        @param interval seconds between progress reports
+        @param on_finish function called with every finished cell
+        """
+        self.cells = cells
+        self.interleave = interleave
+        self.interval = interval
+        self.on_finish = on_finish
+        self.condition = threading.Condition()
+        self.log = logging.getLogger(self.__class__.__name__)
+
+        if threads is None:
+            if interleave:
+                threads = sum(cell.capacity for cell in cells)
+            else:
+                threads = max([1] + [cell.capacity for cell in cells])
+
+        self.threads = max(1, threads)
+
+    def active_cells(self):
+        cells = [cell for cell in self.cells if not cell.exhausted]
+
+        if not self.interleave:
+            cells = cells[:1]
+
+        return cells
+
+    def next_cell(self):
+        """
+        @return the cell with pending tasks and capacity having the fewest
+                tasks in flight, None if there is none
+        """
+        candidates = [cell for cell in self.active_cells()
+                      if cell.in_flight < cell.capacity]
+
+        if not candidates:
+            return None
+
+        return min(candidates, key=lambda cell: cell.in_flight)
+
+    def run(self):
+        """
+        @return the number of failed tasks
+        """
+        pending = []
+
+        for cell in self.cells:
+            if cell.completed:
+                print "Skipping %s, already completed" % cell
+                cell.journal.close()
+                continue
+
+            pending.append(cell)
+
+        self.cells = pending
+        self.in_flight = 0
+        self.started = time.time()
+        self.last_report = self.started
+        pool = ThreadPool(self.threads)
+
+        try:
+            while True:
+                task = self.next_task()
+
+                if task is None:
+                    break
+
+                pool.apply_async(self.run_task, task)
+
+            with self.condition:
+                while self.in_flight:
+                    self.wait()
+        finally:
+            pool.terminate()
+            pool.join()
+
+            for cell in self.cells:
+                cell.journal.close()
+
+        self.report()
+
+        failed = sum(cell.failed for cell in self.cells)
+
+        if failed:
+            print "%d failures, see the errors above" % failed
+
+        return failed
+
+    def next_task(self):
+        with self.condition:
+            while True:
+                if all(cell.exhausted for cell in self.cells):
+                    return None
+
+                cell = None
+
+                if self.in_flight < self.threads:
+                    cell = self.next_cell()
+
+                if cell is None:
+                    self.wait()
+                    continue
+
+                if cell.started is None:
+                    print "Running %s" % cell
+                    cell.start()
+
+                instance = cell.next_task()
+
+                if instance is False:
+                    self.finish(cell)
+                    continue
+
+                cell.in_flight += 1
+                self.in_flight += 1
+                return (cell, instance)
+
+    def wait(self):
+        self.condition.wait(self.interval)
+
+        if time.time() - self.last_report >= self.interval:
+            self.report()
+
+    def run_task(self, cell, instance):
+        # Whole dataset tasks are journaled as instance 0
+        instance_id = 0
+
+        if instance is not None:
+            instance_id = instance.instance_id
+
+        try:
+            cell.run_task(instance)
+            ok = True
+        except Exception, exc:
+            ok = False
+            self.log.error("Error processing instance %d in %s" % (
+                instance_id, cell
+            ))
+            self.log.exception(exc)
+
+        # Nobody reads the result of the task: every error is logged here
+        with self.condition:
+            cell.in_flight -= 1
+            self.in_flight -= 1
+
+            try:
+                if ok:
+                    cell.journal.record(cell.key, instance_id)
+                    cell.done += 1
+                    cell.done_now += 1
+                else:
+                    cell.failed += 1
+            except Exception, exc:
+                cell.failed += 1
+                self.log.error("Error journaling instance %d in %s" % (
+                    instance_id, cell
+                ))
+                self.log.exception(exc)
+
+            try:
+                if cell.finished:
+                    self.finish(cell)
+            finally:
+                self.condition.notify_all()
+
+    def finish(self, cell):
+        """
+        Called with the condition held once the cell has no more tasks
+        """
+        if not cell.finished or cell.closed:
+            return
+
+        cell.closed = True
+
+        try:
+            if cell.processor is not None:
+                cell.processor.finish()
+
+            if not cell.failed:
+                cell.journal.record(cell.key, COMPLETED)
+
+            cell.journal.close()
+        except Exception, exc:
+            # Not journaled as completed, the next run finishes it again
+            cell.failed += 1
+            self.log.error("Error finishing %s" % cell)
+            self.log.exception(exc)
+
+        print "Finished %s" % cell.progress()
+
+        if self.on_finish is not None:
+            try:
+                self.on_finish(cell)
+            except Exception, exc:
+                self.log.error("Error finishing %s" % cell)
+                self.log.exception(exc)
+
+    def report(self):
+        self.last_report = time.time()
+        total = 0
+        done = 0
+        done_now = 0
+
+        for cell in self.cells:
+            if cell.started is not None and not cell.closed:
+                print "Progress %s" % cell.progress()
+
+            if cell.started is not None:
+                total += cell.total
+                done += cell.done
+                done_now += cell.done_now
+
+        elapsed = time.time() - self.started
+        unknown = len([cell for cell in self.cells if cell.started is None])
+        eta = None
+
+        if done_now and elapsed and not unknown:
+            eta = (total - done) * elapsed / done_now
+
+        print "Overall %d/%d tasks of the started cells (%d cells not " \
+              "started yet) %.2f/s ETA %s" % (
+                  done, total, unknown, elapsed and done_now / elapsed or 0.0,
+                  format_duration(eta))
+        sys.stdout.flush()
@@ -0,0 +1,147 @@
+"""
+Bootstrap confidence intervals and paired approximate randomization tests
+computed on the per document counts collected by Metrics.
+
+Resamples are evaluated as a whole through MetricsMatrix and split in
+chunks that can be distributed over a pool of processes.
+"""
+import numpy as np
+from multiprocessing import Pool
+from wikibench.metrics import MetricsMatrix, TP, FP, FN, TN
+
+# Maximum number of resamples (or trials) evaluated by each task
+CHUNK = 250
+
+# Memory (bytes) a task may use for its resamples x documents arrays
+MEMORY_BUDGET = 128 * 1024 * 1024
+
+# Bytes used per resample and document by the int64 counts, their
+# resampled copies and the float64 intermediates of MetricsMatrix (about
+# 116 measured for the randomization test)
+CELL_BYTES = 128
+
+
+def evaluate(counts, metric):
+    """
+    @param counts a (resamples x documents x 4) array of counts
+    @return an array with the value of metric for every resample
+    """
+    matrix = MetricsMatrix(counts[:, :, TP], counts[:, :, FP],
+                           counts[:, :, FN], counts[:, :, TN])
+    return getattr(matrix, metric)()
+
+
+def run_tasks(function, tasks, jobs, pool=None):
+    """
+    Map function over tasks, in the given process pool if any, otherwise
+    in a pool of jobs processes created for the occasion
+    """
+    if pool is not None and len(tasks) > 1:
+        return pool.map(function, tasks)
+
+    if jobs <= 1 or len(tasks) <= 1:
+        return map(function, tasks)
+
+    pool = Pool(min(jobs, len(tasks)))
+
+    try:
+        return pool.map(function, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def chunk_size(documents):
+    """
+    @return the number of resamples of a task over the given number of
+            documents, so that it stays within MEMORY_BUDGET
+    """
+    return max(1, min(CHUNK, MEMORY_BUDGET / (CELL_BYTES * max(1, documents))))
+
+
+def split(total, seed, documents, *args):
+    """
+    Split total resamples over documents in tasks of at most chunk_size,
+    each with its own seed
+    """
+    chunk = chunk_size(documents)
+    return [args + (min(chunk, total - start), seed + i)
+            for i, start in enumerate(xrange(0, total, chunk))]
+
+
+def bootstrap_task(args):
+    documents, metrics, resamples, seed = args
+    rng = np.random.RandomState(seed)
+    indices = rng.randint(0, len(documents), size=(resamples,
+                                                   len(documents)))
+    counts = documents[indices]
+
+    return dict((metric, evaluate(counts, metric)) for metric in metrics)
+
+
+def bootstrap(documents, metrics=('f1', 'macro_f1'), resamples=1000,
+              confidence=0.95, jobs=1, seed=0, pool=None):
+    """
+    Percentile bootstrap confidence intervals.
+
+    @param documents a (documents x 4) array as returned by
+                     Metrics.documents()
+    @param metrics names of the MetricsMatrix methods to estimate
+    @param pool a process pool to reuse instead of creating one
+    @return a dict mapping each metric to a (low, high) tuple
+    """
+    if not len(documents) or resamples <= 0:
+        return dict((metric, (0.0, 0.0)) for metric in metrics)
+
+    tasks = split(resamples, seed, len(documents), documents, metrics)
+    results = run_tasks(bootstrap_task, tasks, jobs, pool)
+    alpha = (1.0 - confidence) / 2 * 100
+    intervals = {}
+
+    for metric in metrics:
+        values = np.concatenate([result[metric] for result in results])
+        low, high = np.percentile(values, [alpha, 100 - alpha])
+        intervals[metric] = (float(low), float(high))
+
+    return intervals
+
+
+def randomization_task(args):
+    a, b, metric, trials, seed = args
+    rng = np.random.RandomState(seed)
+    swap = (rng.rand(trials, len(a)) < 0.5)[:, :, np.newaxis]
+
+    swapped_a = np.where(swap, b, a)
+    swapped_b = np.where(swap, a, b)
+
+    return np.abs(evaluate(swapped_a, metric) - evaluate(swapped_b, metric))
+
+
+def randomization_test(a, b, metric='macro_f1', trials=10000, jobs=1,
+                       seed=0, pool=None):
+    """
+    Paired approximate randomization test: the counts of each document are
+    randomly swapped between the two systems and the difference of metric
+    is compared with the observed one.
+
+    @param a, b (documents x 4) arrays of counts on the same documents
+    @param pool a process pool to reuse instead of creating one
+    @return a (difference, p-value) tuple, difference being metric(a) -
+            metric(b)
+    """
+    if a.shape != b.shape:
+        raise ValueError("Systems evaluated on different documents")
+
+    observed = evaluate(a[np.newaxis], metric)[0] - \
+        evaluate(b[np.newaxis], metric)[0]
+
+    if not len(a) or trials <= 0:
+        return (float(observed), 1.0)
+
+    tasks = split(trials, seed, len(a), a, b, metric)
+    diffs = np.concatenate(run_tasks(randomization_task, tasks, jobs, pool))
+
+    # Tolerate rounding errors on differences equal to the observed one
+    extreme = np.sum(diffs >= abs(observed) - 1e-12)
+
+    return (float(observed), (extreme + 1.0) / (trials + 1.0))
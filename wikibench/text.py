@@ -1,38 +1,192 @@
+"""
+Word tagging based on the lexicon in datasets/lexicon.txt, where each line
+holds a word followed by its tags, separated by spaces.
+
+The first time the lexicon is used it is compiled into an index file
+(lexicon.txt.idx) that is memory-mapped by the following runs. The index
+starts with a header followed by the sorted words padded to a fixed width,
+the offsets of the tags of each word (int64), the tag ids (int32) and the
+newline separated tag names, ids being assigned in order of appearance.
+"""
 import os
 import os.path
+import mmap
+import struct
+import tempfile
+import numpy as np
+
+LEXICON_FILE = os.path.join('datasets', 'lexicon.txt')
+
+MAGIC = 'WKBL'
+HEADER = struct.Struct('<4sqqqq')
+
+_lexicons = {}
+
+
+def encode(word):
+    if isinstance(word, unicode):
+        return word.encode('utf8')
+    return word
+
+
+class Lexicon(object):
+    def __init__(self, index_file):
+        with open(index_file, 'rb') as inputfile:
+            self.data = mmap.mmap(inputfile.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+
+        magic, num_words, self.width, num_tag_ids, names_size = \
+            HEADER.unpack_from(self.data, 0)
+
+        if magic != MAGIC:
+            raise ValueError("%s is not a lexicon index" % index_file)
+
+        pos = HEADER.size
+        self.words = np.frombuffer(self.data, dtype='S%d' % self.width,
+                                   count=num_words, offset=pos)
+        pos += num_words * self.width
+        self.offsets = np.frombuffer(self.data, dtype='<i8',
+                                     count=num_words + 1, offset=pos)
+        pos += (num_words + 1) * 8
+        self.tag_ids = np.frombuffer(self.data, dtype='<i4',
+                                     count=num_tag_ids, offset=pos)
+        pos += num_tag_ids * 4
+
+        names = self.data[pos:pos + names_size]
+        self.tags = names.split('\n') if names else []
+        self.numeric_tags = dict((tag, i) for i, tag in enumerate(self.tags))
+
+    @staticmethod
+    def compile(lexicon_file, index_file):
+        lexicon = {}
+        numeric_tags = {}
+        tags = []
+
+        for line in open(lexicon_file):
+            args = line.strip().split(' ')
+            lexicon[args[0]] = args[1:]
+
+            for tag in args[1:]:
+                if tag not in numeric_tags:
+                    numeric_tags[tag] = len(numeric_tags)
+                    tags.append(tag)
+
+        words = sorted(lexicon)
+        width = max([1] + map(len, words))
+        offsets = [0]
+        tag_ids = []
+
+        for word in words:
+            tag_ids.extend(numeric_tags[tag] for tag in lexicon[word])
+            offsets.append(len(tag_ids))
+
+        names = '\n'.join(tags)
 
-lexicon = {}
-numeric_tags = {}
+        # Other processes may be mapping the index at the same time: write
+        # it aside and atomically rename it into place once complete
+        fd, temp_file = tempfile.mkstemp(
+            prefix=os.path.basename(index_file) + '.',
+            dir=os.path.dirname(os.path.abspath(index_file))
+        )
 
-for line in open(os.path.join('datasets', 'lexicon.txt')):
-    args = line.strip().split(' ')
-    lexicon[args[0]] = args[1:]
+        try:
+            with os.fdopen(fd, 'wb') as output:
+                output.write(HEADER.pack(MAGIC, len(words), width,
+                                         len(tag_ids), len(names)))
+                output.write(np.array(words, dtype='S%d' % width).tostring())
+                output.write(np.array(offsets, dtype='<i8').tostring())
+                output.write(np.array(tag_ids, dtype='<i4').tostring())
+                output.write(names)
 
-    for tag in args[1:]:
-        if tag not in numeric_tags:
-            numeric_tags[tag] = len(numeric_tags)
+            os.rename(temp_file, index_file)
+        except:
+            os.remove(temp_file)
+            raise
+
+    def __len__(self):
+        return len(self.tags)
+
+    def lookup(self, words):
+        """
+        @return two arrays (positions, tag ids) with an entry for each tag
+                of each word, positions being indices into words
+        """
+        keys = [encode(word.lower()) for word in words]
+        positions = np.array([i for i, key in enumerate(keys)
+                              if 0 < len(key) <= self.width], dtype=np.int64)
+
+        if not len(positions) or not len(self.words):
+            return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+        keys = np.array([keys[i] for i in positions],
+                        dtype='S%d' % self.width)
+        index = np.searchsorted(self.words, keys)
+        found = index < len(self.words)
+        found[found] = self.words[index[found]] == keys[found]
+
+        positions = positions[found]
+        index = index[found]
+        starts = self.offsets[index]
+        lengths = self.offsets[index + 1] - starts
+
+        # Expand every [start, start + length) range of tag ids
+        ends = np.cumsum(lengths)
+        tag_positions = np.arange(ends[-1] if len(ends) else 0) + \
+            np.repeat(starts - (ends - lengths), lengths)
+
+        return (np.repeat(positions, lengths),
+                self.tag_ids[tag_positions].astype(np.int64))
+
+
+def get_lexicon(lexicon_file=LEXICON_FILE):
+    """
+    Load (compiling it if needed) the lexicon, once per process
+    """
+    if lexicon_file not in _lexicons:
+        index_file = lexicon_file + '.idx'
+
+        if not os.path.exists(index_file) or \
+           os.path.getmtime(index_file) < os.path.getmtime(lexicon_file):
+            Lexicon.compile(lexicon_file, index_file)
+
+        _lexicons[lexicon_file] = Lexicon(index_file)
+
+    return _lexicons[lexicon_file]
 
 
 def tag_words(words):
-    tags = set()
-    for word in words:
-        for tag in lexicon.get(word.lower(), []):
-            tags.add(tag)
-    return tags
+    lexicon = get_lexicon()
+    _, tag_ids = lexicon.lookup(words)
+    return set(lexicon.tags[i] for i in tag_ids)
 
 
 def tag_words_numerics(words):
-    return set(map(lambda x: numeric_tags[x], tag_words(words)))
+    _, tag_ids = get_lexicon().lookup(words)
+    return set(tag_ids.tolist())
 
 
 def tag_words_numerics_binary(words):
-    binary = []
-    num_tags = tag_words_numerics(words)
+    return tag_words_binary_matrix([words])[0].tolist()
+
+
+def tag_words_binary_matrix(word_lists):
+    """
+    Tag many lists of words at once.
+
+    @return a (lists x tags) uint8 matrix where cell (i, j) is 1 if any
+            word of the i-th list has the tag with id j
+    """
+    lexicon = get_lexicon()
+    matrix = np.zeros((len(word_lists), len(lexicon)), dtype=np.uint8)
+
+    words = []
+    rows = []
+
+    for row, word_list in enumerate(word_lists):
+        words.extend(word_list)
+        rows.extend([row] * len(word_list))
 
-    for i in range(len(numeric_tags)):
-        if i in num_tags:
-            binary.append(1)
-        else:
-            binary.append(0)
+    positions, tag_ids = lexicon.lookup(words)
+    matrix[np.array(rows, dtype=np.int64)[positions], tag_ids] = 1
 
-    return binary
+    return matrix
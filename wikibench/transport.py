@@ -0,0 +1,143 @@
+import time
+import logging
+import threading
+import requests
+from urlparse import urlparse
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout
+
+
+def retry_after(response):
+    """
+    @return the seconds to wait according to the Retry-After header
+    """
+    try:
+        return max(0.0, float(response.headers.get('Retry-After', 0)))
+    except ValueError:
+        return 0.0
+
+
+class CountingAdapter(HTTPAdapter):
+    """
+    HTTPAdapter keeping track of the connection pools it hands out, so that
+    we can tell how many connections were opened and how many requests
+    reused an already open connection.
+    """
+    def __init__(self, *args, **kwargs):
+        self.pools = {}
+        super(CountingAdapter, self).__init__(*args, **kwargs)
+
+    def get_connection(self, url, proxies=None):
+        pool = super(CountingAdapter, self).get_connection(url, proxies)
+        # Keep a reference even if the pool manager evicts it
+        self.pools[id(pool)] = pool
+        return pool
+
+    def stats(self):
+        pools = self.pools.values()
+        opened = sum(map(lambda x: x.num_connections, pools))
+        issued = sum(map(lambda x: x.num_requests, pools))
+        return {
+            'requests': issued,
+            'opened': opened,
+            'reused': max(0, issued - opened),
+        }
+
+
+class Transport(object):
+    """
+    Keep-alive HTTP client shared by the annotators. Requests failing with
+    a connection error, a timeout, a 429 or a 5xx status are retried up to
+    `retries` times waiting backoff * 2^attempt seconds (or what the
+    Retry-After header asks) between attempts.
+
+    An optional RateLimiter (see wikibench.ratelimit) paces the requests
+    sent to each host.
+    """
+    def __init__(self, pool_size=10, timeout=60, retries=3, backoff=0.5,
+                 limiter=None):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.limiter = limiter
+        self.retried = 0
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.lock = threading.Lock()
+
+        self.adapter = CountingAdapter(pool_connections=pool_size,
+                                       pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+
+        while True:
+            delay = self.backoff * 2 ** attempt
+
+            try:
+                r = self.send(method, url, **kwargs)
+
+                if (r.status_code < 500 and r.status_code != 429) or \
+                   attempt >= self.retries:
+                    return r
+
+                reason = "HTTP %d" % r.status_code
+                delay = max(delay, retry_after(r))
+            except (ConnectionError, Timeout), exc:
+                if attempt >= self.retries:
+                    raise
+
+                reason = str(exc)
+
+            attempt += 1
+
+            with self.lock:
+                self.retried += 1
+
+            self.log.warning("%s %s failed (%s), retry %d/%d in %.1fs" % (
+                method, url, reason, attempt, self.retries, delay
+            ))
+            time.sleep(delay)
+
+    def send(self, method, url, **kwargs):
+        """
+        Issue a single request, within the limits of the host if any
+        """
+        if self.limiter is None:
+            return self.session.request(method, url, **kwargs)
+
+        host = urlparse(url).netloc
+        self.limiter.acquire(host)
+        start = time.time()
+        ok = False
+
+        try:
+            r = self.session.request(method, url, **kwargs)
+            ok = r.status_code < 500 and r.status_code != 429
+            return r
+        finally:
+            self.limiter.release(host, time.time() - start, ok)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        stats = self.adapter.stats()
+        stats['retried'] = self.retried
+        return stats
+
+    def summary(self):
+        summary = "[REQ: %(requests)d OPENED: %(opened)d " \
+                  "REUSED: %(reused)d RETRIED: %(retried)d]" % self.stats()
+
+        if self.limiter is not None and self.limiter.adaptive:
+            summary += " " + self.limiter.summary()
+
+        return summary
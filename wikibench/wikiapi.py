@@ -1,21 +1,145 @@
+import gzip
+import time
+import codecs
+import sqlite3
+import threading
 import wikipedia
 
 
 _wid_to_title_cache = {}
 _title_to_wid_cache = {}
+_persistent_cache = None
+
+
+class TitleCache(object):
+    """
+    Persistent bidirectional title <-> WID mapping stored in a sqlite
+    database. Failed lookups are stored as negative entries (WID -1) that
+    expire after negative_ttl seconds, so that they are retried later.
+    """
+    def __init__(self, filename, negative_ttl=7 * 24 * 3600):
+        self.filename = filename
+        self.negative_ttl = negative_ttl
+        self.lock = threading.Lock()
+
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS titles ("
+            "title TEXT PRIMARY KEY, wid INTEGER, mtime REAL)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS titles_wid ON titles (wid)"
+        )
+        self.db.commit()
+
+    @staticmethod
+    def normalize(title):
+        return title.replace('_', ' ').strip()
+
+    def get_wid(self, title):
+        """
+        @return the WID of title, -1 for a fresh negative entry or None if
+                the title is unknown
+        """
+        with self.lock:
+            row = self.db.execute(
+                "SELECT wid, mtime FROM titles WHERE title = ?",
+                (self.normalize(title),)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        wid, mtime = row
+
+        if wid == -1 and time.time() - mtime > self.negative_ttl:
+            return None
+
+        return wid
+
+    def get_title(self, wid):
+        # Negative WIDs mark the titles known not to exist
+        if wid < 0:
+            return None
+
+        with self.lock:
+            row = self.db.execute(
+                "SELECT title FROM titles WHERE wid = ? LIMIT 1", (wid,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        return row[0]
+
+    def put(self, title, wid):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO titles VALUES (?, ?, ?)",
+                (self.normalize(title), wid, time.time())
+            )
+            self.db.commit()
+
+    def load_dump(self, filename):
+        """
+        Load a page title dump made of lines in the form WID<TAB>title,
+        optionally gzip compressed.
+
+        @return the number of loaded titles
+        """
+        if filename.endswith('.gz'):
+            inputfile = codecs.getreader('utf8')(gzip.open(filename, 'rb'))
+        else:
+            inputfile = codecs.open(filename, 'r', 'utf8')
+
+        def iterate_dump():
+            now = time.time()
+
+            for line in inputfile:
+                wid, title = line.rstrip('\r\n').split('\t', 1)
+                yield (self.normalize(title), int(wid), now)
+
+        with self.lock:
+            before = self.db.total_changes
+            self.db.executemany(
+                "INSERT OR REPLACE INTO titles VALUES (?, ?, ?)",
+                iterate_dump()
+            )
+            self.db.commit()
+
+        inputfile.close()
+        return self.db.total_changes - before
+
+
+def set_cache(filename, negative_ttl=7 * 24 * 3600):
+    """
+    Back the title <-> WID lookups with a persistent TitleCache
+    """
+    global _persistent_cache
+    _persistent_cache = TitleCache(filename, negative_ttl)
+    return _persistent_cache
 
 
 def get_wid_from_title(title):
     if title in _title_to_wid_cache:
         return _title_to_wid_cache[title]
 
-    try:
-        wid = int(wikipedia.page(title).pageid)
-    except Exception, exc:
-        print "Error while recovering ID for %s (%s)" % (
-            title.encode('utf8'), str(exc)
-        )
-        wid = -1
+    wid = None
+
+    if _persistent_cache is not None:
+        wid = _persistent_cache.get_wid(title)
+
+    if wid is None:
+        try:
+            wid = int(wikipedia.page(title).pageid)
+        except Exception, exc:
+            print "Error while recovering ID for %s (%s)" % (
+                title.encode('utf8'), str(exc)
+            )
+            wid = -1
+
+        if _persistent_cache is not None:
+            _persistent_cache.put(title, wid)
 
     _title_to_wid_cache[title] = wid
 
@@ -23,3 +147,35 @@ def get_wid_from_title(title):
         _wid_to_title_cache[wid] = title
 
     return wid
+
+
+def get_title_from_wid(wid):
+    if wid in _wid_to_title_cache:
+        return _wid_to_title_cache[wid]
+
+    title = None
+
+    if _persistent_cache is not None:
+        title = _persistent_cache.get_title(wid)
+
+    if title is None:
+        try:
+            title = wikipedia.page(pageid=wid).title
+        except Exception, exc:
+            print "Error while recovering title for %d (%s)" % (wid, str(exc))
+            return None
+
+        if _persistent_cache is not None:
+            _persistent_cache.put(title, wid)
+
+    _wid_to_title_cache[wid] = title
+    _title_to_wid_cache[title] = wid
+
+    return title
+
+if __name__ == "__main__":
+    import sys
+    cache_file, dump_file = sys.argv[1:]
+    cache = TitleCache(cache_file)
+
+    print "Loaded %d titles from %s" % (cache.load_dump(dump_file), dump_file)